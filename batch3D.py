@@ -0,0 +1,176 @@
+# -*- coding: utf8 -*-
+
+__title__  = "Batch conversion of 3D files"
+__author__ = "Jens M. Plonka"
+__url__    = "https://www.github.com/jmplonka/Importer3D"
+
+'''
+Converts many 3D files in parallel, one worker process per core:
+
+	python batch3D.py -o out -f npz assets/ "legacy/**/*.max"
+
+The FreeCAD libraries must be on the python path (or run it with FreeCADCmd).
+Each file is imported into its own hidden document and written either as
+compressed numpy archive (points_<i>, facets_<i> and names) or as FreeCAD
+document. A crashing worker doesn't abort the batch: the files that were in
+flight are converted again, one at a time in a new process.
+'''
+
+import os, sys, glob, json, argparse, traceback
+from collections        import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from time               import perf_counter
+
+EXTENSIONS = ('.3ds', '.max', '.lwo', '.lws', '.ma', '.mb', '.gsm')
+FORMATS    = ('npz', 'fcstd')
+IN_FLIGHT  = 2 # files per worker submitted at once
+
+def findFiles(patterns):
+	'''
+	Expands the directories (recursively) and glob patterns to the supported files.
+	'''
+	files = []
+	for pattern in patterns:
+		if (os.path.isdir(pattern)):
+			for folder, dirs, names in os.walk(pattern):
+				dirs.sort()
+				files += [os.path.join(folder, name) for name in sorted(names) if (os.path.splitext(name)[1].lower() in EXTENSIONS)]
+		else:
+			files += [name for name in sorted(glob.glob(pattern, recursive=True)) if (os.path.isfile(name))]
+	return list(dict.fromkeys([os.path.abspath(name) for name in files]))
+
+def getOutputNames(files):
+	'''
+	Returns a unique output name (without extension) for each file.
+	'''
+	names, used = {}, set()
+	for fileName in files:
+		base = os.path.basename(fileName).replace('.', '_')
+		name, i = base, 1
+		while (name.lower() in used):
+			i += 1
+			name = '%s_%d' %(base, i)
+		used.add(name.lower())
+		names[fileName] = name
+	return names
+
+def newResult(fileName, error = None):
+	return {'file': fileName, 'output': None, 'meshes': 0, 'seconds': 0.0, 'error': error, 'attempts': 1}
+
+def convertFile(fileName, output, fmt):
+	'''
+	Imports the file into a new document and writes it to output + extension.
+	Runs in the worker processes - errors are returned, not raised.
+	'''
+	result = newResult(fileName)
+	start  = perf_counter()
+	try:
+		import FreeCAD, importer3D, importCache
+		from importUtils import getMeshArrays, saveMeshArrays
+		importCache.CACHE_ENABLED = False # the workers must not race for the cache folder
+		doc = FreeCAD.newDocument('Batch', hidden=True)
+		doc.UndoMode = 0 # the document is thrown away - no need for undo
+		try:
+			importer3D.read(doc, fileName)
+			meshes = getMeshArrays(doc)
+			result['meshes'] = len(meshes)
+			if (fmt == 'fcstd'):
+				result['output'] = output + '.FCStd'
+				doc.saveAs(result['output'])
+			else:
+				result['output'] = output + '.npz'
+				saveMeshArrays(result['output'], meshes)
+		finally:
+			FreeCAD.closeDocument(doc.Name)
+	except (KeyboardInterrupt, SystemExit):
+		raise
+	except BaseException: # import3DS gives up with a BaseException
+		result['error'] = traceback.format_exc()
+	result['seconds'] = perf_counter() - start
+	return result
+
+def runPool(queue, outputs, fmt, workers, report):
+	'''
+	Converts the queued files in parallel. Returns the files that were in
+	flight when a worker process died - the remaining ones stay queued.
+	'''
+	inFlight = {}
+	with ProcessPoolExecutor(workers) as pool:
+		try:
+			while (queue or inFlight):
+				while (queue and (len(inFlight) < IN_FLIGHT * workers)):
+					fileName = queue.popleft()
+					inFlight[pool.submit(convertFile, fileName, outputs[fileName], fmt)] = fileName
+				done, running = wait(inFlight, return_when=FIRST_COMPLETED)
+				for future in done:
+					fileName = inFlight.pop(future)
+					try:
+						result = future.result()
+					except BrokenProcessPool:
+						inFlight[future] = fileName # converted again in isolation
+						raise
+					except (KeyboardInterrupt, SystemExit):
+						raise
+					except BaseException: # the worker couldn't return the result
+						result = newResult(fileName, traceback.format_exc())
+					report(result)
+		except BrokenProcessPool:
+			return list(inFlight.values())
+	return []
+
+def runIsolated(fileName, output, fmt):
+	with ProcessPoolExecutor(1) as pool:
+		try:
+			result = pool.submit(convertFile, fileName, output, fmt).result()
+		except BrokenProcessPool:
+			result = newResult(fileName, 'Worker process crashed')
+	result['attempts'] += 1
+	return result
+
+def printResult(result):
+	if (result['error'] is None):
+		print("OK   %8.2fs %s -> %s (%d meshes)" %(result['seconds'], result['file'], result['output'], result['meshes']))
+	else:
+		print("FAIL %8.2fs %s: %s" %(result['seconds'], result['file'], result['error'].strip().splitlines()[-1]))
+	sys.stdout.flush()
+
+def convertFiles(files, folder, fmt = 'npz', workers = None):
+	'''
+	Converts the files into the folder. Returns the result of each file.
+	'''
+	workers = workers or os.cpu_count() or 1
+	outputs = dict([(fileName, os.path.join(folder, name)) for fileName, name in getOutputNames(files).items()])
+	results = []
+	def report(result):
+		results.append(result)
+		printResult(result)
+	queue = deque(files)
+	while (queue):
+		for fileName in runPool(queue, outputs, fmt, workers, report):
+			# one of these files killed the worker - only a crash in isolation counts.
+			report(runIsolated(fileName, outputs[fileName], fmt))
+	return results
+
+def main(args = None):
+	parser = argparse.ArgumentParser(description = "Converts 3D files (%s) in parallel." %(', '.join(EXTENSIONS)))
+	parser.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+	parser.add_argument('-o', '--output', default='.', help="folder for the converted files")
+	parser.add_argument('-f', '--format', choices=FORMATS, default='npz', help="npz: numpy mesh arrays, fcstd: FreeCAD document")
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="number of worker processes")
+	parser.add_argument('-r', '--report', help="write the results to this JSON file")
+	args = parser.parse_args(args)
+
+	files = findFiles(args.inputs)
+	os.makedirs(args.output, exist_ok=True)
+	start = perf_counter()
+	results = convertFiles(files, args.output, args.format, args.jobs)
+	failed = [result for result in results if (result['error'] is not None)]
+	print("%d files converted, %d failed in %.2fs" %(len(results) - len(failed), len(failed), perf_counter() - start))
+	if (args.report):
+		with open(args.report, 'w') as file:
+			json.dump(results, file, indent=1)
+	return 1 if (failed) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
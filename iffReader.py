@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+
+__title__  = "Reader for IFF based files"
+__author__ = "Jens M. Plonka"
+__url__    = "https://www.github.com/jmplonka/Importer3D"
+
+'''
+Zero-copy reader for the Interchange File Format (IFF) used by LightWave
+objects (*.lwo) and Maya binary files (*.mb).
+The file is memory mapped and every chunk is handed out as memoryview on the
+mapped data, so neither the chunk headers nor the payloads are copied.
+'''
+
+import mmap, traceback
+from struct import Struct
+
+ALIGNMENT = { # group chunk type => alignment of the contained chunks
+	b'FORM': 2, b'CAT ': 2, b'LIST': 2, b'PROP': 2, # => 16Bit
+	b'FOR4': 4, b'CAT4': 4, b'LIS4': 4, b'PRO4': 4, # => 32Bit
+	b'FOR8': 8, b'CAT8': 8, b'LIS8': 8, b'PRO8': 8, # => 64Bit
+}
+
+UNPACK_SIZE = {
+	2: Struct('>H').unpack_from, # LWO sub-chunks
+	4: Struct('>I').unpack_from,
+	8: Struct('>Q').unpack_from, # 64Bit Maya files: 4 padding bytes precede the size
+}
+
+class IffFile():
+	def __init__(self, fileName):
+		self.map = None
+		with open(fileName, 'rb') as file:
+			try:
+				self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+				self.data = memoryview(self.map)
+			except ValueError: # empty files can't be mapped
+				self.data = memoryview(b'')
+
+	def __enter__(self): return self
+
+	def __exit__(self, excType, exc, tb):
+		if (tb is not None):
+			traceback.clear_frames(tb) # the failed reader's arrays refer to the data
+		self.close()
+
+	def close(self):
+		if (self.map is not None):
+			self.data.release()
+			self.map.close() # raises BufferError as long as arrays refer to the data
+			self.map = None
+
+def getHeaderSize(sizeLen):
+	if (sizeLen == 8): return 16
+	return 4 + sizeLen
+
+def readChunks(data, offset = 0, end = None, sizeLen = 4, align = 2):
+	'''
+	Iterates over the chunks in data[offset:end].
+	Args:
+		sizeLen: number of bytes of the chunk size (2, 4 or 8).
+		align:   chunks are padded to a multiple of align bytes (2 => EVEN).
+	Returns:
+		a generator of (tag, memoryview) pairs. Group chunks (FORM, LIST, ...)
+		are returned as any other chunk - use readGroup to step into them.
+	'''
+	if (end is None): end = len(data)
+	header  = getHeaderSize(sizeLen)
+	getSize = UNPACK_SIZE[sizeLen]
+	while (offset + header <= end):
+		tag   = data[offset:offset + 4].tobytes()
+		size, = getSize(data, offset + header - sizeLen)
+		start = offset + header
+		yield tag, data[start:min(start + size, end)]
+		offset = start + size
+		if (size % align):
+			offset += align - (size % align)
+
+def readGroup(data):
+	'''
+	Splits the content of a group chunk (FORM, LIST, ...) into its type and the contained chunks.
+	'''
+	return data[0:4].tobytes(), data[4:]
+
+def readForm(data):
+	'''
+	Returns the type and the content of the FORM chunk a file starts with,
+	or (None, None) if the data is no IFF file.
+	'''
+	for tag, form in readChunks(data, 0, len(data), 4, 2):
+		if ((tag == b'FORM') and (len(form) >= 4)):
+			return readGroup(form)
+		break
+	return None, None
@@ -8,10 +8,12 @@ __url__    = "https://www.github.com/jmplonka/Importer3D"
 ref. http://paulbourke.net/dataformats/3ds/
 '''
 
-import os, sys, numpy, traceback, FreeCAD
+import io, sys, numpy, traceback, FreeCAD
 from struct      import unpack
 from math        import degrees, sqrt, sin, cos
-from importUtils import newObject
+from importUtils import newObject, newIndexedObject, setTexture, ChunkProfiler
+
+PROFILE = False # Collect chunk statistics and write them to <file>.profile.json?
 
 VERSION                             = 0x0002
 COLOR                               = 0x0010 # 3 floats
@@ -178,11 +180,13 @@ DESC_MAP = { \
 	V_SCALE                             : 'V-Scale',
 }
 
+def getChunkType(id):
+	return DESC_MAP.get(id, "%04X" %id)
+
 def getChunkName(chunk):
-	id = chunk.id
 	if (chunk.name):
-		return "[%s] '%s'" %(DESC_MAP.get(id, "%04X" %id), chunk.name)
-	return "[%s]" % DESC_MAP.get(id, "%04X" %id)
+		return "[%s] '%s'" %(getChunkType(chunk.id), chunk.name)
+	return "[%s]" % getChunkType(chunk.id)
 
 def getData(chunk, id):
 	subChunk = chunk.getSubChunk(id)
@@ -260,18 +264,20 @@ class FacesDescriptionChunk(AbstractChunk):
 			c = chopper.getUnsignedShort()
 			d = chopper.getUnsignedShort()
 			self.data.append([a, c, b, d])
-	def createShape(self, chopper, face, mtx, name, pts):
+	def createShape(self, chopper, face, mtx, name, pts, uvs):
+		if (chopper.profiler): token = chopper.profiler.start()
 		# translate the points according to the transformation matrix
 		pt = numpy.ones((len(pts), 4), numpy.float32)
 		pt[:,:3] = pts
 		tpt = numpy.transpose(numpy.dot(mtx, numpy.transpose(pt)))
 
-		data = []
-		for idx in self.data:
-			data.append([tpt[idx[0]], tpt[idx[1]], tpt[idx[2]]])
-
-		obj = newObject(chopper.tg, name, data)
+		corners = numpy.array(self.data, numpy.int32).reshape((-1, 4))[:, 0:3]
+		obj = newIndexedObject(chopper.tg, name, tpt[:, 0:3], corners)
 		chopper.adjustMaterial(obj, face)
+		if ((obj is not None) and (uvs is not None) and (len(uvs) == len(pts))):
+			# the texture coordinates share the vertex indices
+			setTexture(obj, uvs, corners, chopper.getTextureName(face))
+		if (chopper.profiler): chopper.profiler.built(getChunkType(self.id), token)
 		return
 
 class FacesMaterialChunk(AbstractChunk):
@@ -324,9 +330,17 @@ class PercentageChunk(AbstractChunk):
 			b = chopper.getChunkBytes()
 			raise Exception("Don't know how to handle percentage type '%s'=%s" %(chr(t), " ".join(["%02X" %(c) for c in b])))
 
+class IntPercentageChunk(AbstractChunk):
+	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
+	def __str__(self): return "%s: %s%%" % (getChunkName(self), self.data)
+	def loadData(self, chopper): self.data = chopper.getUnsignedShort() * 0.01
+
 class MainChunk(AbstractChunk):
 	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
 
+class MapChunk(AbstractChunk):
+	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
+
 class MaterialChunk(AbstractChunk):
 	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
 	def initialize(self, chopper):
@@ -336,12 +350,14 @@ class MaterialChunk(AbstractChunk):
 		specular = getData(self, MAT_SPECULAR_COLOR)
 		shinines = getData(self, MAT_SHININESS_PERCENT)
 		transparency = getData(self, MAT_TRANSPARENCY_PERCENTAGE)
+		diffuseMap = self.getSubChunk(MAT_DIFFUSE_MAP)
 		self.data = {}
 		if (ambient): self.data['ambient'] = ambient
 		if (diffuse): self.data['diffuse'] = diffuse
 		if (specular): self.data['specular'] = specular
 		if (shinines): self.data['shinines'] = shinines
 		if (transparency): self.data['transparency'] = transparency
+		if (diffuseMap): self.data['texture'] = getData(diffuseMap, MAT_TEXTURE_NAME)
 		chopper.materials[self.name] = self.data
 
 class MeshInfoChunk(AbstractChunk):
@@ -409,8 +425,9 @@ class NamedObjectChunk(AbstractChunk):
 							[0, 0, 1, 0], \
 							[0, 0, 0, 1]], numpy.float32)
 					points = mObj.getSubChunkData(TRI_VERTEXL)
+					uvs    = mObj.getSubChunkData(TRI_MAPPINGCOORS)
 					for face in faces:
-						dsc.createShape(chopper, face, mtx, self.name, points)
+						dsc.createShape(chopper, face, mtx, self.name, points, uvs)
 
 class NTriObjectChunk(AbstractChunk):
 	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
@@ -595,8 +612,7 @@ class Vertex2ListChunk(AbstractChunk):
 	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
 	def loadData(self, chopper):
 		numVertices = chopper.getUnsignedShort()
-		self.data = [None] * numVertices
-		for i in range(numVertices): self.data.append(chopper.getPoint2f())
+		self.data = chopper.getPoints2f(numVertices)
 
 class Vertex3ListChunk(AbstractChunk):
 	def __init__(self, id, l): AbstractChunk.__init__(self, id, l)
@@ -615,12 +631,13 @@ class Importer:
 		self.constructors[FACES_DESCRIPTION] = FacesDescriptionChunk
 		self.constructors[HIERARCHY] = HierarchyChunk
 		self.constructors[HIERARCHY_INFO] = HierarchyInfoChunk
-		self.constructors[INT_PERCENT] = PercentageChunk
+		self.constructors[INT_PERCENT] = IntPercentageChunk
 		self.constructors[MAIN] = MainChunk
 		self.constructors[MATERIAL] = MaterialChunk
 		self.constructors[MAT_AMBIENT_COLOR] = ColorChunk
 		self.constructors[MAT_BUMP_PERCENT] = PercentageChunk
 		self.constructors[MAT_DIFFUSE_COLOR] = ColorChunk
+		self.constructors[MAT_DIFFUSE_MAP] = MapChunk
 		self.constructors[MAT_NAME] = StringChunk
 		self.constructors[MAT_REFLECTION_BLUR_PERCENTAGE] = PercentageChunk
 		self.constructors[MAT_SHININESS_PERCENT] = PercentageChunk
@@ -650,8 +667,10 @@ class Importer:
 		self.constructors[KEYFRAMER] = AbstractChunk
 		self.constructors[CURRENT_FRAME] = CurrentFrameChunk
 
-		self.end = os.path.getsize(filename)
-		self.file = open(filename, 'rb')
+		with open(filename, 'rb') as file:
+			self.buffer = file.read() # the arrays are views on it
+		self.end = len(self.buffer)
+		self.file = io.BytesIO(self.buffer)
 		self.limit = self.end
 		self.tg = doc
 		self.currentGroup = doc
@@ -659,8 +678,10 @@ class Importer:
 		self.materials = {}
 		self.namedObjectes = {}
 		self.meshInfo = {}
+		self.profiler = ChunkProfiler(filename) if (PROFILE) else None
 
-	def close(self): self.file.close()
+	def close(self):
+		self.file.close()
 
 	def getUnsignedByte(self):      return ord(self.file.read(1))
 	def getUnsignedShort(self):     return unpack('<H', self.file.read(2))[0]
@@ -670,6 +691,11 @@ class Importer:
 	def getFloat(self):             return unpack('<f', self.file.read(4))[0]
 	def getPoint2f(self):           return unpack('<ff', self.file.read(8))
 	def getPoint3f(self):           return unpack('<fff', self.file.read(12))
+	def getPoints2f(self, count):
+		# a view on the file's buffer - the file position is advanced as if read.
+		pos = self.file.tell()
+		self.file.seek(pos + 8 * count)
+		return numpy.frombuffer(self.buffer, '<f4', 2 * count, pos).reshape((count, 2))
 
 	def getChunkId(self):	        return self.getUnsignedShort()
 	def getChunkLen(self):	        return (self.getInt() - 6)
@@ -708,12 +734,16 @@ class Importer:
 
 				if ((chunk is not None) and (chunk.len != 0)):
 					parentChunk.addSubChunk(chunk)
+					if (self.profiler): token = self.profiler.start()
 					chunk.loadData(self)
+					if (self.profiler): self.profiler.decoded(getChunkType(chunkId), self.file.tell() - finishedPosition + chunkLen + 6, token)
 #					FreeCAD.Console.PrintMessage("%sadded %s\n" %((level + 1) * '  ', chunk))
 					try:
 						if (self.hasRemaining()):
 							self.loadSubChunks(chunk, chunkLen, level + 1)
+						if (self.profiler): token = self.profiler.start()
 						chunk.initialize(self)
+						if (self.profiler): self.profiler.built(getChunkType(chunkId), token)
 					except:
 						FreeCAD.Console.PrintError(traceback.format_exc())
 						FreeCAD.Console.PrintError("%s - Trying to continue\n" %(chunk))
@@ -728,6 +758,7 @@ class Importer:
 		if ((obj is not None) and (mat is not None)):
 			material = self.materials.get(mat.name)
 			if (material):
+				if (not obj.ViewObject): return # no GUI
 				obj.ViewObject.ShapeMaterial.AmbientColor  = material.get('ambient',  (0,0,0))
 				obj.ViewObject.ShapeMaterial.DiffuseColor  = material.get('diffuse',  (0.8,0.8,0.8))
 #				obj.ViewObject.ShapeMaterial.EmissiveColor = material.get('emissive', (0,0,0))
@@ -737,12 +768,21 @@ class Importer:
 			else:
 				FreeCAD.Console.PrintError("Can't find material '%s'!\n" %(mat.name))
 
+	def getTextureName(self, mat):
+		if (mat is not None):
+			material = self.materials.get(mat.name)
+			if (material): return material.get('texture')
+		return None
+
 def read(doc, filename):
 	reader = Importer(doc, filename)
-	chunkId = reader.getChunkId()
-	chunkLen = reader.getChunkLen()
-	if (chunkId == MAIN):
-		chunk = reader.createChunk(chunkId, chunkLen)
-		reader.loadSubChunks(chunk, chunkLen)
-	reader.close()
+	try:
+		chunkId = reader.getChunkId()
+		chunkLen = reader.getChunkLen()
+		if (chunkId == MAIN):
+			chunk = reader.createChunk(chunkId, chunkLen)
+			reader.loadSubChunks(chunk, chunkLen)
+	finally:
+		reader.close()
+		if (reader.profiler): reader.profiler.report() # the timings of failed imports as well
 	return
@@ -0,0 +1,206 @@
+# -*- coding: utf8 -*-
+
+__title__  = "Cache of imported 3D scenes"
+__author__ = "Jens M. Plonka"
+__url__    = "https://www.github.com/jmplonka/Importer3D"
+
+'''
+Keeps the triangulated meshes of imported files on disk. Each entry is a
+folder with one .npy file per array and a JSON manifest. It is keyed by the
+file's content hash, the reader's version and the reader's options, so
+neither renaming nor touching the file invalidates it.
+On a hit the arrays are memory mapped and the meshes are built straight
+from the mapped data - the file isn't parsed at all.
+The cache is off by default - set CACHE_ENABLED to use it.
+Only scenes that consist of mesh objects are cached. Links, parts and
+solids are always imported again.
+'''
+
+import os, sys, json, shutil, hashlib, numpy, FreeCAD
+from importUtils import newIndexedObject, getMeshArrays
+
+CACHE_ENABLED = False
+CACHE_FOLDER  = None      # None => FreeCAD's cache folder / Importer3D
+CACHE_SIZE    = 1 << 30   # bytes, the least recently used entries are removed first
+BLOCK_SIZE    = 0x100000  # bytes read at once to compute the content hash
+MANIFEST      = 'manifest.json'
+MATERIAL      = ('AmbientColor', 'DiffuseColor', 'SpecularColor', 'EmissiveColor', 'Shininess', 'Transparency')
+
+_versions = {}
+_usage    = None # bytes used by the cache folder, None => not yet scanned
+
+def getFolder():
+	if (CACHE_FOLDER is not None): return CACHE_FOLDER
+	try:
+		base = FreeCAD.getUserCachePath()
+	except AttributeError:
+		base = os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'Importer3D')
+
+def getModules(module, modules = None):
+	'''
+	Returns the add-on's modules the reader uses - directly or through
+	other modules - including the reader itself, sorted by name.
+	'''
+	if (modules is None): modules = {}
+	modules[module.__name__] = module
+	folder = os.path.dirname(os.path.abspath(__file__))
+	for value in list(vars(module).values()):
+		used = value if (type(value) is type(sys)) else sys.modules.get(getattr(value, '__module__', None) or '')
+		if ((used is not None) and (used.__name__ not in modules)):
+			fileName = getattr(used, '__file__', None)
+			if (fileName and (os.path.dirname(os.path.abspath(fileName)) == folder)):
+				getModules(used, modules)
+	return [modules[name] for name in sorted(modules)]
+
+def getVersion(module):
+	'''
+	The reader's version is the hash of its source and of all modules it
+	uses - any change of them or of the cache format invalidates its entries.
+	'''
+	version = _versions.get(module.__name__)
+	if (version is None):
+		sha = hashlib.sha256()
+		for name in [__file__] + [used.__file__ for used in getModules(module)]:
+			with open(name, 'rb') as file:
+				sha.update(file.read())
+		version = sha.hexdigest()
+		_versions[module.__name__] = version
+	return version
+
+def getOptions(module):
+	'''
+	The reader's options are the module constants of the modules it uses.
+	The readers look them up when called, so the values are the applied ones.
+	'''
+	options = {}
+	for used in getModules(module):
+		for name, value in vars(used).items():
+			if (name.isupper() and isinstance(value, (bool, int, float, str, type(None)))):
+				options['%s.%s' %(used.__name__, name)] = value
+	return options
+
+def getKey(fileName, module):
+	sha = hashlib.sha256()
+	with open(fileName, 'rb') as file:
+		for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+			sha.update(block)
+	sha.update(module.__name__.encode('utf8'))
+	sha.update(getVersion(module).encode('ascii'))
+	sha.update(json.dumps(getOptions(module), sort_keys=True).encode('utf8'))
+	return sha.hexdigest()
+
+def getMaterial(obj):
+	if (not obj.ViewObject): return None # no GUI
+	material = obj.ViewObject.ShapeMaterial
+	return dict([(name, getattr(material, name)) for name in MATERIAL])
+
+def setMaterial(obj, values):
+	if (obj.ViewObject):
+		material = obj.ViewObject.ShapeMaterial
+		for name in MATERIAL:
+			setattr(material, name, values[name])
+		obj.ViewObject.ShapeMaterial = material
+
+def getProperties(obj):
+	'''
+	Returns the dynamic per corner data (texture coordinates, vertex maps and their indices) and the texture image.
+	'''
+	arrays, strings = {}, {}
+	for name in obj.PropertiesList:
+		typeId = obj.getTypeIdOfProperty(name)
+		info = (obj.getGroupOfProperty(name), obj.getDocumentationOfProperty(name), typeId)
+		if (typeId == 'App::PropertyFloatList'):
+			arrays[name] = (info, numpy.array(getattr(obj, name), numpy.float32))
+		elif (typeId == 'App::PropertyIntegerList'):
+			arrays[name] = (info, numpy.array(getattr(obj, name), numpy.int32))
+		elif ((typeId == 'App::PropertyString') and (info[0] == 'Texture')):
+			strings[name] = (info, getattr(obj, name))
+	return arrays, strings
+
+def store(key, objects, fileName):
+	'''
+	Writes the mesh objects created for the file to the cache.
+	'''
+	if (any([not obj.isDerivedFrom('Mesh::Feature') for obj in objects])): return
+	folder = getFolder()
+	target = os.path.join(folder, key)
+	if (os.path.isdir(target)): return
+	tmp = '%s.%d.tmp' %(target, os.getpid())
+	os.makedirs(tmp)
+	try:
+		meshes = []
+		for i, (obj, (label, points, facets)) in enumerate(zip(objects, getMeshArrays(objects[0].Document, objects))):
+			entry = {'label': label, 'points': '%d_points.npy' %(i), 'facets': '%d_facets.npy' %(i), 'arrays': {}, 'strings': {}, 'material': getMaterial(obj)}
+			numpy.save(os.path.join(tmp, entry['points']), points)
+			numpy.save(os.path.join(tmp, entry['facets']), facets)
+			arrays, strings = getProperties(obj)
+			for name, ((group, doc, typeId), values) in arrays.items():
+				entry['arrays'][name] = {'file': '%d_%s.npy' %(i, name), 'type': typeId, 'group': group, 'doc': doc}
+				numpy.save(os.path.join(tmp, entry['arrays'][name]['file']), values)
+			for name, ((group, doc, typeId), value) in strings.items():
+				entry['strings'][name] = {'value': value, 'group': group, 'doc': doc}
+			meshes.append(entry)
+		with open(os.path.join(tmp, MANIFEST), 'w') as file:
+			json.dump({'file': os.path.basename(fileName), 'meshes': meshes}, file, indent=1)
+		used = getSize(tmp)
+		os.rename(tmp, target)
+	finally:
+		if (os.path.isdir(tmp)):
+			shutil.rmtree(tmp, ignore_errors=True) # an other process was faster
+	global _usage
+	if (_usage is None):
+		_usage = evict(folder, CACHE_SIZE) # the folder is scanned once per session
+	else:
+		_usage += used
+		if (_usage > CACHE_SIZE):
+			_usage = evict(folder, CACHE_SIZE)
+
+def load(doc, key):
+	'''
+	Creates the cached meshes in the document. Returns False if the file isn't cached.
+	'''
+	folder = os.path.join(getFolder(), key)
+	manifest = os.path.join(folder, MANIFEST)
+	if (not os.path.isfile(manifest)): return False
+	with open(manifest, 'r') as file:
+		data = json.load(file)
+	os.utime(manifest) # least recently used
+	for entry in data['meshes']:
+		points = numpy.load(os.path.join(folder, entry['points']), mmap_mode='r')
+		facets = numpy.load(os.path.join(folder, entry['facets']), mmap_mode='r')
+		obj = newIndexedObject(doc, entry['label'], points, facets)
+		for name, prop in entry['arrays'].items():
+			obj.addProperty(prop['type'], name, prop['group'], prop['doc'])
+			setattr(obj, name, numpy.load(os.path.join(folder, prop['file']), mmap_mode='r').tolist())
+		for name, prop in entry['strings'].items():
+			obj.addProperty('App::PropertyString', name, prop['group'], prop['doc'])
+			setattr(obj, name, prop['value'])
+		if (entry['material']):
+			setMaterial(obj, entry['material'])
+	FreeCAD.Console.PrintMessage("Loaded %d meshes of '%s' from the cache\n" %(len(data['meshes']), data['file']))
+	return True
+
+def getSize(folder):
+	return sum([entry.stat().st_size for entry in os.scandir(folder)])
+
+def evict(folder, size):
+	'''
+	Removes the least recently used entries until the cache fits into 3/4 of
+	size bytes, so the next entries don't trigger an other scan right away.
+	Returns the bytes still used.
+	'''
+	entries = []
+	total = 0
+	for name in os.listdir(folder):
+		manifest = os.path.join(folder, name, MANIFEST)
+		if (os.path.isfile(manifest)):
+			used = getSize(os.path.join(folder, name))
+			entries.append((os.path.getmtime(manifest), used, name))
+			total += used
+	if (total <= size): return total
+	for mtime, used, name in sorted(entries):
+		if (total <= size * 3 // 4): break
+		shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+		total -= used
+	return total
@@ -3,10 +3,33 @@
 __title__  = "FreeCAD Maya file importer"
 __author__ = "Jens M. Plonka"
 
-import sys, shlex, struct, FreeCAD, numpy, traceback
-from importUtils import newObject, getShort, getInt, setEndianess, LITTLE_ENDIAN, CENTER, DIR_Z, getValidName
+import re, FreeCAD, numpy
+from itertools   import groupby
+from operator    import itemgetter
+from importUtils import newIndexedObject, setTexture, getShort, getInt, setEndianess, LITTLE_ENDIAN, DIR_Z, getValidName, getSpans
+from importUtils import getFloat as readFloat # getFloat reads from the GDL script
+from triangulate import getTriangleCorners, bridgeHoles
+from iffReader   import IffFile
 from FreeCAD     import Console, Vector as VEC
-from Part        import makePolygon, Face, show
+from Part        import makePolygon, Face
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+MESH_PRISMS = False # Create cPRISM_ as meshes instead of extruded solids?
+
+# Runs of these statements are converted at once: keyword => values per statement (0: any)
+BULK_STATEMENTS = {'VERT': 3, 'TEVE': 5, 'EDGE': 5, 'PGON': 0}
+
+TOKEN     = re.compile(r'"[^"]*"|\'[^\']*\'|=|[^\s,="\']+')
+MESH_NAME = re.compile(r'^Mesh\s+name\s*:\s*(.*?)\s*$')
+
+# GDL transformations: keyword => number of values
+TRANSFORMATIONS = {
+	'ADDX': 1, 'ADDY': 1, 'ADDZ': 1, 'ADD': 3, # move along the axes
+	'MULX': 1, 'MULY': 1, 'MULZ': 1, 'MUL': 3, # scale the axes
+	'ROTX': 1, 'ROTY': 1, 'ROTZ': 1, 'ROT': 4, # rotate around the axes in degree
+}
+AXES = {'X': 0, 'Y': 1, 'Z': 2}
 
 class GsmHeader():
 	def __init__(self):
@@ -31,8 +54,8 @@ class GsmBlockHeader():
 class GsmBlock():
 	def __init__(self, data, bHdr):
 		self.pos = bHdr.blockPos + 4
-		self.key = data[bHdr.blockPos:self.pos]
-		self.subName = data[self.pos:self.pos + 2]
+		self.key = bytes(data[bHdr.blockPos:self.pos])
+		self.subName = bytes(data[self.pos:self.pos + 2])
 		self.subKey, self.pos  = getShort(data, self.pos + 2)
 		self.size, self.pos    = getInt(data, self.pos)
 		self.version, self.pos = getInt(data, self.pos)
@@ -48,9 +71,9 @@ class GsmCsd3(GsmBlock):
 		GsmBlock.__init__(self, data, bHdr)
 		end = bHdr.blockPos + bHdr.blockLength
 		if (data[bHdr.blockPos + 0x10:bHdr.blockPos + 0x13] == b'\xEF\xBB\xBF'):
-			self.text = data[bHdr.blockPos + 0x13:end].decode('utf8')
+			self.text = bytes(data[bHdr.blockPos + 0x13:end]).decode('utf8')
 		else:
-			self.text = data[bHdr.blockPos + 0x10:end].decode('cp1252')
+			self.text = bytes(data[bHdr.blockPos + 0x10:end]).decode('cp1252')
 
 class GsmCsiu(GsmBlock):
 	def __init__(self, data, bHdr): GsmBlock.__init__(self, data, bHdr)
@@ -62,65 +85,64 @@ class GsmCsrp(GsmBlock):
 	def __init__(self, data, bHdr): GsmBlock.__init__(self, data, bHdr)
 
 class GsmDrapInfo():
+	# One parameter record of 0x40 bytes: type, value, name and flags.
 	def __init__(self, data, pos):
-		self.pos = bHdr.blockPos + 4
-		self.key = data[bHdr.blockPos:self.pos]
-		self.varType, self.pos = readShort(data, self.pos)
+		self.pos = pos
+		self.varType, self.pos = getShort(data, self.pos)
 		if (self.varType == 0x02):
-			self.bytes = data[self.pos:self.pos + 0x12]
+			self.bytes = bytes(data[self.pos:self.pos + 0x12])
 			self.pos += 0x12
 			self.value, self.pos = readFloat(data, self.pos)
 		elif (self.varType == 0x04):
-			self.bytes = data[self.pos:self.pos + 0x0A]
+			self.bytes = bytes(data[self.pos:self.pos + 0x0A])
 			self.pos += 0x0A
 			r, self.pos = readFloat(data, self.pos)
 			g, self.pos = readFloat(data, self.pos)
 			b, self.pos = readFloat(data, self.pos)
 			self.value = (r, g, b)
 		elif (self.varType == 0x0d):
-			self.bytes = readBytes(0x12);
-			self.bytes = data[self.pos:self.pos + 0x12]
+			self.bytes = bytes(data[self.pos:self.pos + 0x12])
 			self.pos += 0x12
-			self.value, self.pos = readInt(data, self.pos)
+			self.value, self.pos = getInt(data, self.pos)
 			self.value = (self.value != 0)
 		elif (self.varType == 0x0f):
-			self.bytes = data[self.pos:self.pos + 0x12]
+			self.bytes = bytes(data[self.pos:self.pos + 0x12])
 			self.pos += 0x12
-			self.value, self.pos = readInt(data, self.pos)
+			self.value, self.pos = getInt(data, self.pos)
 		else:
-			self.bytes = data[self.pos:self.pos + 0x16]
+			self.bytes = bytes(data[self.pos:self.pos + 0x16])
 			self.pos += 0x16
 			self.value = None
-		self.name = data[self.pos:self.pos + 0x20].decode('utf8')
+		self.name = bytes(data[self.pos:self.pos + 0x20]).decode('utf8', 'ignore')
 		self.pos = self.pos + 0x20
 		i = self.name.find('\0')
 		if (i != -1): self.name = self.name[0:i]
-		self.flag1, self.pos = readInt(data, self.pos);
-		self.flag2, self.pos = readInt(data, self.pos)
+		self.key = self.name
+		self.flag1, self.pos = getInt(data, self.pos)
+		self.flag2, self.pos = getInt(data, self.pos)
 
-class GsmDrap(GsmBlock):
+class GsmDrap(GsmBlock): # Parameters
 	def __init__(self, data, bHdr):
 		GsmBlock.__init__(self, data, bHdr)
+		end = bHdr.blockPos + bHdr.blockLength
 		self.count, self.pos = getShort(data, bHdr.blockPos + 0x32)
 		self.infos = {}
 		self.pos = bHdr.blockPos + 0x80
 		i = self.count
-		while (i > 0):
+		while ((i > 0) and (self.pos + 0x40 <= end)):
 			info = GsmDrapInfo(data, self.pos)
 			self.pos += 0x40
 			self.infos[info.key] = info
 			i -= 1
-		txt = data[self.pos, bHdr.blockPos + bHdr.blockLength].decode('UTF-16LE')
+		txt = bytes(data[self.pos:end]).decode('UTF-16LE', 'ignore')
 		self.strings = txt.split('\0')
 
-class GsmFfig(GsmBlock):
+class GsmFfig(GsmBlock): # Thumbnail
 	def __init__(self, data, bHdr):
 		GsmBlock.__init__(self, data, bHdr)
-		pos = bHdr.blockPos + 4
-		end = pos + 4 + bHdr.length
-		self.data = data[pos:end]
-#		with open('C:/workspace/tumbnail.png', 'wb') as f:
-#			f.write(data)
+		block = bytes(data[bHdr.blockPos + 0x10:bHdr.blockPos + bHdr.blockLength])
+		pos = block.find(PNG_SIGNATURE)
+		self.data = block[pos:] if (pos >= 0) else None
 
 class GsmScna(GsmBlock):
 	def __init__(self, data, bHdr): GsmBlock.__init__(self, data, bHdr)
@@ -133,9 +155,9 @@ class GsmTxtc(GsmBlock):
 
 def readGsmHeader(data):
 	header = GsmHeader()
-	header.magic        = data[0:2]
+	header.magic        = bytes(data[0:2])
 	header.version, pos = getShort(data, 2)
-	header.name         = data[pos:pos+0x20]
+	header.name         = bytes(data[pos:pos+0x20])
 	count, pos          = getInt(data, pos + 0x20)
 	header.mySg, pos    = readGsmMySg(data, pos)
 	header.daeH, pos    = readGsmDaeH(data, pos)
@@ -149,22 +171,22 @@ def readGsmHeader(data):
 
 def readGsmMySg(data, pos):
 	mySg = GsmMySg()
-	mySg.key      = data[pos:pos + 0x04].decode('cp1252')
+	mySg.key      = bytes(data[pos:pos + 0x04]).decode('cp1252')
 	mySg.val, pos = getInt(data, pos + 4)
 	return mySg, pos
 
 def readGsmDaeH(data, pos):
 	daeH = GsmDaeH()
-	daeH.key         = data[pos:pos + 0x04].decode('cp1252')
+	daeH.key         = bytes(data[pos:pos + 0x04]).decode('cp1252')
 	daeH.offset, pos = getInt(data, pos + 4)
 	daeH.length, pos = getInt(data, pos)
-	daeH.data        = data[pos:pos+0x44]
+	daeH.data        = bytes(data[pos:pos+0x44])
 	return daeH, pos + 0x44
 
 def readGsmBlockHeader(data, pos):
 	bHdr = GsmBlockHeader()
 	ofs  = pos + 4
-	bHdr.key = data[pos:ofs].decode('utf8')
+	bHdr.key = bytes(data[pos:ofs]).decode('utf8', 'ignore')
 	bHdr.blockPos, ofs    = getInt(data, ofs)
 	bHdr.blockLength, ofs = getInt(data, ofs)
 	bHdr.flags, ofs       = getInt(data, ofs)
@@ -177,13 +199,50 @@ def readGsmBlock(data, bHdr):
 	#if (bHdr.key == 'CSIU'): return GsmCsiu(data, bHdr)
 	#if (bHdr.key == 'CSLV'): return GsmCslv(data, bHdr)
 	#if (bHdr.key == 'CSRP'): return GsmCsrp(data, bHdr)
-	#if (bHdr.key == 'DRAP'): return GsmDrap(data, bHdr)
-	#if (bHdr.key == 'FFIG'): return GsmFfig(data, bHdr) #Thumbnail
+	if (bHdr.key == 'DRAP'): return GsmDrap(data, bHdr)
+	if (bHdr.key == 'FFIG'): return GsmFfig(data, bHdr) #Thumbnail
 	#if (bHdr.key == 'SCNA'): return GsmScna(data, bHdr)
 	#if (bHdr.key == 'SRCM'): return GsmSrcm(data, bHdr)
 	#if (bHdr.key == 'TXTC'): return GsmTxtc(data, bHdr)
 	return None
 
+class GsmFile(IffFile):
+	'''
+	Memory mapped GSM file: only the header and the block table are read, the
+	blocks are decoded on demand.
+	'''
+	def __init__(self, fileName):
+		IffFile.__init__(self, fileName)
+		setEndianess(LITTLE_ENDIAN)
+		self.header, pos = readGsmHeader(self.data)
+		self.table  = {}
+		self.blocks = {}
+		for bHdr in self.header.blocks:
+			if ((bHdr.key not in self.table) and (bHdr.blockPos + bHdr.blockLength <= len(self.data))):
+				self.table[bHdr.key] = bHdr
+
+	def getBlock(self, key):
+		if (key not in self.blocks):
+			bHdr = self.table.get(key)
+			self.blocks[key] = None if (bHdr is None) else readGsmBlock(self.data, bHdr)
+		return self.blocks[key]
+
+def readThumbnail(fileName):
+	'''
+	Returns the PNG data of the thumbnail or None - the script isn't touched.
+	'''
+	with GsmFile(fileName) as file:
+		ffig = file.getBlock('FFIG')
+		return None if (ffig is None) else ffig.data
+
+def readParameters(fileName):
+	'''
+	Returns the parameters (GsmDrapInfo) of the library part.
+	'''
+	with GsmFile(fileName) as file:
+		drap = file.getBlock('DRAP')
+		return [] if (drap is None) else list(drap.infos.values())
+
 def getFloat(st):
 	f = st.get_token()
 	try:
@@ -197,13 +256,208 @@ def getColor(st):
 	g = getFloat(st)
 	b = getFloat(st)
 	return (r, g, b)
+
+def getRotation(axis, angle):
+	'''
+	Returns the matrix of the rotation by angle (in degree) around the axis.
+	'''
+	axis = numpy.asarray(axis, numpy.float64)
+	axis = axis / numpy.linalg.norm(axis)
+	a = numpy.radians(angle)
+	k = numpy.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+	mtx = numpy.identity(4)
+	mtx[:3, :3] = numpy.identity(3) * numpy.cos(a) + k * numpy.sin(a) + numpy.outer(axis, axis) * (1.0 - numpy.cos(a))
+	return mtx
+
+def getTransformation(tok, values):
+	'''
+	Returns the 4x4 matrix of the GDL transformation statement.
+	'''
+	mtx = numpy.identity(4)
+	if (tok == 'ADD'):
+		mtx[:3, 3] = values
+	elif (tok == 'MUL'):
+		mtx[0, 0], mtx[1, 1], mtx[2, 2] = values
+	elif (tok == 'ROT'):
+		mtx = getRotation(values[0:3], values[3])
+	else:
+		i = AXES[tok[3]]
+		if (tok.startswith('ADD')):
+			mtx[i, 3] = values[0]
+		elif (tok.startswith('MUL')):
+			mtx[i, i] = values[0]
+		else:
+			mtx = getRotation(numpy.identity(3)[i], values[0])
+	return mtx
+
+def transformPoints(mtx, points):
+	return numpy.dot(points, mtx[:3, :3].T) + mtx[:3, 3]
+
+def getContours(points, status):
+	'''
+	Splits the contour points of a prism at the end markers (status -1) and
+	drops the closing points. The outer contour runs counter clockwise, the
+	holes clockwise.
+	'''
+	contours = []
+	for contour in numpy.split(numpy.arange(len(points)), numpy.flatnonzero(status == -1) + 1):
+		if ((len(contour) > 1) and (points[contour[0]] == points[contour[-1]]).all()):
+			contour = contour[:-1]
+		if (len(contour) > 2):
+			x, y = points[contour, 0], points[contour, 1]
+			area = numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1))
+			if ((area > 0) == (len(contours) > 0)):
+				contour = contour[::-1]
+			contours.append(contour)
+	return contours
+
+def getPrismMesh(points, status, h):
+	'''
+	Returns the vertices and facets of the prism with the contour points
+	(x, y) and the height h: the caps are triangulated with holes, the side
+	walls are two triangles for each contour edge.
+	'''
+	contours = getContours(points, status)
+	n = len(points)
+	vertices = numpy.zeros((2 * n, 3), numpy.float64)
+	vertices[:n, 0:2] = points
+	vertices[n:, 0:2] = points
+	vertices[n:, 2]   = h
+	if (len(contours) == 0): return vertices, numpy.zeros((0, 3), numpy.int64)
+
+	# bottom cap facing down, top cap facing up
+	ring = bridgeHoles(vertices, contours)
+	corners, polygons = getTriangleCorners(vertices, ring, [0, len(ring)])
+	bottom = ring[corners]
+	a, b, c = vertices[bottom[:, 0]], vertices[bottom[:, 1]], vertices[bottom[:, 2]]
+	up = numpy.cross(b - a, c - a)[:, 2] > 0
+	bottom[up] = bottom[up][:, ::-1]
+	top = bottom[:, ::-1] + n
+
+	# side walls
+	sizes = numpy.array([len(contour) for contour in contours], numpy.int64)
+	offsets = numpy.concatenate(([0], numpy.cumsum(sizes)))
+	edges = numpy.concatenate(contours)
+	nxt = numpy.arange(1, len(edges) + 1)
+	nxt[offsets[1:] - 1] = offsets[:-1]
+	s, e = edges, edges[nxt]
+	sides = numpy.concatenate((numpy.stack((s, e, e + n), axis=1), numpy.stack((s, e + n, s + n), axis=1)))
+
+	facets = numpy.concatenate((bottom, top, sides))
+	if (h < 0): facets = facets[:, ::-1]
+	return vertices, facets
+
+def stripComment(line):
+	'''
+	Splits the line into the code and the comment ('!' outside of strings).
+	'''
+	pos = line.find('!')
+	if (pos < 0): return line, None
+	if (('"' in line) or ("'" in line)):
+		quote = None
+		for pos, c in enumerate(line):
+			if (quote is not None):
+				if (c == quote): quote = None
+			elif (c in '"\''):
+				quote = c
+			elif (c == '!'):
+				break
+		else:
+			return line, None
+	return line[:pos], line[pos + 1:]
+
+def readStatements(text):
+	'''
+	Yields the statements of the GDL script as (keyword, arguments). Lines
+	ending with ',' are continued on the next line, comment lines are yielded
+	as ('!', comment).
+	'''
+	parts = []
+	for line in text.splitlines():
+		code, comment = stripComment(line)
+		code = code.strip()
+		if (not code):
+			if ((comment is not None) and (not parts)):
+				yield '!', comment.strip()
+			continue
+		parts.append(code)
+		if (not code.endswith(',')):
+			words = ' '.join(parts).split(None, 1)
+			yield words[0], words[1] if (len(words) > 1) else ''
+			parts = []
+	if (parts):
+		words = ' '.join(parts).split(None, 1)
+		yield words[0], words[1] if (len(words) > 1) else ''
+
+def getNumbers(args):
+	return numpy.array(args.replace(',', ' ').split(), numpy.float64)
+
+def getValues(key, statements, width):
+	'''
+	Converts the arguments of a run of statements with the same keyword into
+	one array of numbers. Returns the values and the number of values of each
+	statement. Statements that can't be converted are skipped.
+	'''
+	counts = numpy.array([args.count(',') + 1 for args in statements], numpy.int64)
+	try:
+		values = getNumbers(' '.join(statements))
+		if ((len(values) == counts.sum()) and ((width == 0) or (counts == width).all())):
+			return values, counts
+	except ValueError:
+		pass
+	# at least one statement is broken => convert them one by one
+	values, counts = [numpy.zeros(0, numpy.float64)], []
+	for args in statements:
+		try:
+			numbers = getNumbers(args)
+			if ((len(numbers) != args.count(',') + 1) or ((width > 0) and (len(numbers) != width))):
+				raise ValueError("%d values" %(len(numbers)))
+			values.append(numbers)
+			counts.append(len(numbers))
+		except ValueError as e:
+			Console.PrintWarning("Skipped '%s %s': %s\n" %(key, args, e))
+	return numpy.concatenate(values), numpy.array(counts, numpy.int64)
+
+class GsmTokens():
+	'''
+	Tokens of a control statement's arguments - strings keep their quotes.
+	'''
+	def __init__(self, args):
+		self.tokens = TOKEN.findall(args)
+		self.pos    = 0
+
+	def get_token(self):
+		if (self.pos < len(self.tokens)):
+			self.pos += 1
+			return self.tokens[self.pos - 1]
+		return ''
+
+	def getNumbers(self, count):
+		values = numpy.array(self.tokens[self.pos:self.pos + count], numpy.float64)
+		if (len(values) < count):
+			raise Exception("Missing values - %d of %d found!" %(len(values), count))
+		self.pos += count
+		return values
+
 class GsmMaterial():
 	def __init__(self):
-		self.name = None
-		self.number = -1
+		self.name         = None
+		self.number       = -1
+		self.surfaceRGB   = (0.8, 0.8, 0.8)
+		self.ambient      = 0.2
+		self.diffuse      = 1.0
+		self.specular     = 0.0
+		self.transparent  = 0.0
+		self.shining      = 0.0
+		self.transparencyAttentuation = 0.0
+		self.specularRGB  = (0.0, 0.0, 0.0)
+		self.emissionRGB  = (0.0, 0.0, 0.0)
+		self.emissionAttentuation = 0.0
 
 class GsmReader():
-	def __init__(self):
+	def __init__(self, meshPrisms = None):
+		if (meshPrisms is None): meshPrisms = MESH_PRISMS
+		self.meshPrisms  = meshPrisms
 		self.currentName = None
 		self.materials   = None
 		self.vertexList  = None
@@ -211,71 +465,111 @@ class GsmReader():
 		self.edgeList    = None
 		self.faceList    = None
 		self.model       = None
-		self.material    = None
-		self.mat_block   = 0
 		self.currentMaterial = None
-
-	def resetMaterial(self):
-		self.mat_block = 0
-		if (self.material is not None):
-			self.materials[self.material.name] = self.material
-			self.material = None
+		self.globLayer   = ''
+		self.globId      = ''
+		self.globIntId   = ''
+		self.transforms  = [numpy.identity(4)] # accumulated transformations
+
+	def getName(self):
+		name = self.globLayer or 'object'
+		if (self.globId):
+			name = '%s_%s' %(name, self.globId)
+		if (self.globIntId):
+			name = '%s_%s' %(name, self.globIntId)
+		return name
 
 	def readBase(self, st):
-		self.resetMaterial()
 		self.textureList = []
 		self.vertexList  = []
 		self.edgeList    = []
 		self.faceList    = []
 
 	def adjustMaterial(self, mesh):
-		if (self.material is not None):
+		if ((self.currentMaterial is not None) and (mesh.ViewObject)):
 			amb = self.currentMaterial.ambient
 			dif = self.currentMaterial.diffuse
-			mesh.ViewObject.ShapeMaterial.AmbientColor  = (amb, amb, amb)
-			mesh.ViewObject.ShapeMaterial.DiffuseColor  = (dif, dif, dif)
+			r, g, b = self.currentMaterial.surfaceRGB
+			mesh.ViewObject.ShapeMaterial.AmbientColor  = (r * amb, g * amb, b * amb)
+			mesh.ViewObject.ShapeMaterial.DiffuseColor  = (r * dif, g * dif, b * dif)
 			mesh.ViewObject.ShapeMaterial.EmissiveColor = self.currentMaterial.emissionRGB
 			mesh.ViewObject.ShapeMaterial.SpecularColor = self.currentMaterial.specularRGB
-			mesh.ViewObject.ShapeMaterial.Shininess     = self.currentMaterial.shining
-			mesh.ViewObject.ShapeMaterial.Transparency  = self.currentMaterial.transparency
-
-	def getFaces(self):
-		faces = []
-		for i in self.faceList:
-			i0 = i[0]
-			i1 = i[1]
-			i2 = i[2]
-
-			if (i0 < 0):
-				e0 = self.edgeList[-i0 - 1]
-				idx0 = e0[1] - 1
-				idx1 = e0[0] - 1
-			else:
-				e0 = self.edgeList[i0 - 1]
-				idx0 = e0[0] - 1
-				idx1 = e0[1] - 1
-			if (i1 < 0):
-				e1 = self.edgeList[-i1 - 1]
-				idx2 = e1[0] - 1
-			else:
-				e1 = self.edgeList[i1 - 1]
-				idx2 = e1[1] - 1
-			faces.append([idx0, idx1, idx2])
-		return faces
+			mesh.ViewObject.ShapeMaterial.Shininess     = self.currentMaterial.shining / 100.0
+			mesh.ViewObject.ShapeMaterial.Transparency  = self.currentMaterial.transparent
+
+	def getVertices(self):
+		if (len(self.vertexList) == 0): return numpy.zeros((0, 3), numpy.float64)
+		return numpy.concatenate(self.vertexList)
+
+	def getTextureCoordinates(self):
+		'''
+		Returns the (u, v) of all vertices or None if the body has no TEVE
+		statements. Vertices defined by VERT get (0, 0).
+		'''
+		if (all(uvs is None for uvs in self.textureList)): return None
+		return numpy.concatenate([numpy.zeros((len(points), 2)) if (uvs is None) else uvs for points, uvs in zip(self.vertexList, self.textureList)])
+
+	def getEdges(self):
+		if (len(self.edgeList) == 0): return numpy.zeros((0, 5), numpy.int32)
+		return numpy.concatenate(self.edgeList)
+
+	def getPolygons(self):
+		'''
+		Returns the edge references of all PGON statements (PGON n, vect,
+		status, edge_1, ... edge_n) as flat array and the polygon offsets.
+		'''
+		values  = numpy.concatenate([values for values, counts in self.faceList])
+		counts  = numpy.concatenate([counts for values, counts in self.faceList])
+		starts  = numpy.cumsum(counts) - counts
+		sizes   = numpy.clip(values[starts], 0, numpy.maximum(counts - 3, 0))
+		positions, offsets = getSpans(starts + 3, sizes)
+		return values[positions], offsets
+
+	def getFaces(self, vertices):
+		'''
+		Resolves the polygons' 1-based edge references into rings of 0-based
+		vertex indices: each edge contributes its start vertex, negative
+		references run the edge in reverse. The contours of polygons with
+		holes (separated by 0) are joined by bridge edges.
+		Returns the flat vertex indices and the polygon offsets.
+		'''
+		edges = self.getEdges()
+		if ((len(self.faceList) == 0) or (len(edges) == 0)): return numpy.zeros(0, numpy.int64), numpy.zeros(1, numpy.int64)
+		refs, offsets = self.getPolygons()
+		sizes   = numpy.diff(offsets)
+		rows    = edges[numpy.clip(numpy.abs(refs), 1, len(edges)) - 1]
+		indices = numpy.where(refs < 0, rows[:, 1], rows[:, 0]).astype(numpy.int64) - 1
+		polygon = numpy.repeat(numpy.arange(len(sizes)), sizes)
+		# polygons referencing missing edges or vertices are skipped
+		invalid = (refs != 0) & ((numpy.abs(refs) > len(edges)) | (indices < 0) | (indices >= len(vertices)))
+		indices[refs == 0] = -1
+		skip  = numpy.bincount(polygon[invalid], minlength=len(sizes)) > 0
+		holed = numpy.bincount(polygon[refs == 0], minlength=len(sizes)) > 0
+		simple = numpy.flatnonzero(~skip & ~holed)
+		positions, simpleOffsets = getSpans(offsets[simple], sizes[simple])
+		rings = [indices[positions]]
+		ringSizes = [sizes[simple]]
+		for p in numpy.flatnonzero(~skip & holed):
+			ring = indices[offsets[p]:offsets[p + 1]]
+			contours = numpy.split(ring, numpy.flatnonzero(refs[offsets[p]:offsets[p + 1]] == 0))
+			contours = [contour[contour >= 0] for contour in contours] # drop the separators
+			ring = bridgeHoles(vertices, [contour for contour in contours if (len(contour) > 0)])
+			rings.append(ring)
+			ringSizes.append([len(ring)])
+		ringSizes = numpy.concatenate(ringSizes).astype(numpy.int64)
+		return numpy.concatenate(rings), numpy.concatenate(([0], numpy.cumsum(ringSizes)))
 
 	def readBody(self, st, doc):
-		self.resetMaterial()
 		number = getInteger(st)
 
-		if (len(self.vertexList) > 0):
-			data = []
-			faces = self.getFaces()
-			for f in faces:
-				p0 = self.vertexList[f[0]]
-				p1 = self.vertexList[f[1]]
-				p2 = self.vertexList[f[2]]
-				data.append([p0, p1, p2])
-			mesh = newObject(doc, self.currentName, data)
+		vertices = transformPoints(self.transforms[-1], self.getVertices())
+		indices, offsets = self.getFaces(vertices)
+		corners, polygons = getTriangleCorners(vertices, indices, offsets)
+		if (len(corners) > 0):
+			mesh = newIndexedObject(doc, self.currentName or self.getName(), vertices, indices[corners])
+			uvs = self.getTextureCoordinates()
+			if (uvs is not None):
+				setTexture(mesh, uvs, indices[corners], None)
 			self.adjustMaterial(mesh)
 
 	def readDefine(self, st):
@@ -288,70 +582,31 @@ class GsmReader():
 		# 0.000000, 0.000000, 0.000000, !emission RGB [0.0..1.0]x3
 		# 0.000000
 		#
-		if (self.mat_block == 0):
-			tok = st.get_token()
-			if (tok == 'MATERIAL'):
-				self.material = GsmMaterial()
-				self.material.name = st.get_token()
-				self.material.number = getInteger(st)
-				self.mat_block = 1
-			elif (tok == 'TEXTURE'):
-				self.mat_block = -1
-			else:
-				raise Exception("Unknown Token '%s' in DEFINE!" %(tok))
-
-		elif (self.mat_block == 1):
-			self.material.ambient = getFloat(st)
-			self.material.diffuse = getFloat(st)
-			self.material.specular = getFloat(st)
-			self.mat_block = 2
-			return
-
-		elif (self.mat_block == 2):
-			self.material.transparent = getFloat(st)
-			self.mat_block = 3
-			return
-
-		elif (self.mat_block == 3):
-			self.material.shining = getFloat(st)
-			self.mat_block = 4
-			return
-
-		elif (self.mat_block == 4):
-			self.material.transparencyAttentuation = getFloat(st)
-			self.mat_block = 5
-			return
-
-		elif (self.mat_block == 5):
-			self.material.specularRGB = getColor(st)
-			self.mat_block = 6
-			return
-
-		elif (self.mat_block == 6):
-			self.material.emissionRGB = getColor(st)
-			self.mat_block = 7
-			return
-
-		elif (self.mat_block == 7):
-			self.material.emissionAttentuation = getFloat(st)
-			self.resetMaterial()
-			return
-
-		elif (self.mat_block != -1):
-			raise Exception("Unrecognized token in DEFINE: '%s'!" %(tok))
-
-	def readEdge(self, st):
+		# The statement spans all lines of the definition, so the material
+		# is complete here - no pending block has to be reset later on.
+		tok = st.get_token()
+		if (tok == 'MATERIAL'):
+			material = GsmMaterial()
+			material.name = st.get_token()
+			material.number = getInteger(st)
+			material.surfaceRGB = getColor(st)
+			if (material.number == 0): # only the general definition has all values
+				material.ambient  = getFloat(st)
+				material.diffuse  = getFloat(st)
+				material.specular = getFloat(st)
+				material.transparent = getFloat(st)
+				material.shining  = getFloat(st)
+				material.transparencyAttentuation = getFloat(st)
+				material.specularRGB = getColor(st)
+				material.emissionRGB = getColor(st)
+				material.emissionAttentuation = getFloat(st)
+			self.materials[material.name] = material
+
+	def readEdges(self, values, counts):
 		# EDGE 1, 2, 1, 17, 2 !#1
-		self.resetMaterial()
-		p1 = getInteger(st)
-		p2 = getInteger(st)
-		a  = getInteger(st)
-		b  = getInteger(st)
-		c  = getInteger(st)
-		self.edgeList.append((p1, p2, a, b, c))
+		self.edgeList.append(values.reshape((-1, 5)).astype(numpy.int32))
 
 	def readMaterial(self, st):
-		self.resetMaterial()
 		name = st.get_token()
 		mat = self.materials.get(name)
 		if (mat is not None):
@@ -359,64 +614,48 @@ class GsmReader():
 
 	def readModel(self, st):
 		# MODEL SURFACE
-		self.resetMaterial()
 		self.model = st.get_token()
 
-	def readPolygon(self, st):
+	def readPolygons(self, values, counts):
 		# PGON 3, 0, 2, 1, 2, 3
-		self.resetMaterial()
-		a = getInteger(st)
-		b = getInteger(st)
-		c = getInteger(st)
-		d = getInteger(st)
-		e = getInteger(st)
-		f = getInteger(st)
-
-		self.faceList.append([d, e, f])
-
-	def readTextureVertex(self, st):
-		self.readVertex(st)
-
-		x = getFloat(st)
-		y = getFloat(st)
-
-		self.textureList.append([x, y])
-
-	def readVertex(self, st):
-		self.resetMaterial()
-		x = getFloat(st)
-		y = getFloat(st)
-		z = getFloat(st)
-
-		self.vertexList.append([x, y, z])
-
-	def readComment(self, st):
-		tok = st.get_token()
-		if (len(tok) > 0):
-			if (tok == 'Mesh'):
-				tok = st.get_token()
-				if (tok == 'name'):
-					tok = st.get_token() # skip ':'
-					self.currentName = st.get_token()
-
-	def readCPrism(self, doc, lines, i, name):
-		# colmat, colmat, colmat,
-		i += 1
-		line = lines[i].strip()
-		# n, h,
-		values = line.split(',')
-		n = int(values[0].strip())
-		h = float(values[1].strip())
+		self.faceList.append((values.astype(numpy.int64), counts))
+
+	def readTextureVertices(self, values, counts):
+		# TEVE x, y, z, u, v
+		values = values.reshape((-1, 5))
+		self.vertexList.append(values[:, 0:3])
+		self.textureList.append(values[:, 3:5])
+
+	def readVertices(self, values, counts):
+		# VERT x, y, z
+		self.vertexList.append(values.reshape((-1, 3)))
+		self.textureList.append(None)
+
+	def readComment(self, comment):
+		match = MESH_NAME.match(comment)
+		if (match):
+			self.currentName = match.group(1)
+
+	def readCPrism(self, doc, st):
+		# cPRISM_ top_material, bottom_material, side_material,
+		#         n, h,
+		#         x1, y1, s1, ... xn, yn, sn
+		name = self.getName()
+		for i in range(3): st.get_token()
+		n = getInteger(st)
+		h = getFloat(st)
+		values = st.getNumbers(3 * n).reshape((-1, 3))
+		status = values[:, 2].astype(numpy.int64)
+		mtx = self.transforms[-1]
+		if (self.meshPrisms):
+			vertices, facets = getPrismMesh(values[:, 0:2], status, h)
+			if (len(facets) > 0):
+				mesh = newIndexedObject(doc, name, transformPoints(mtx, vertices), facets)
+				self.adjustMaterial(mesh)
+			return
 		wires = []
 		points = []
-		while (line[-1] == ','):
-			i += 1
-			line = lines[i].strip()
-			# n * (x_i, y_i, s_i)
-			values = line.split(',')
-			x = float(values[0].strip())
-			y = float(values[1].strip())
-			s = int(values[2].strip())
+		for x, y, s in zip(values[:, 0], values[:, 1], status):
 			points.append(VEC(x, y, 0))
 			if (s == -1):
 				wire = makePolygon(points)
@@ -425,109 +664,93 @@ class GsmReader():
 		face = Face(wires)
 		prism = doc.addObject("Part::Feature", getValidName(name))
 		prism.Label = name
-		prism.Shape = face.extrude(h * DIR_Z)
-		return line, i
+		shape = face.extrude(h * DIR_Z)
+		if (not numpy.allclose(mtx, numpy.identity(4))):
+			shape = shape.transformGeometry(FreeCAD.Matrix(*mtx.ravel().tolist()))
+		prism.Shape = shape
+
+	def readTransformation(self, tok, st):
+		# ADDX dx / ROTZ alpha / MUL mx, my, mz / ...
+		try:
+			values = [getFloat(st) for i in range(TRANSFORMATIONS[tok])]
+			mtx = getTransformation(tok, values)
+		except Exception:
+			# expressions and variables aren't evaluated - DEL must still find an entry.
+			Console.PrintWarning("Can't evaluate transformation '%s' - ignored!\n" %(tok))
+			mtx = numpy.identity(4)
+		self.transforms.append(numpy.dot(self.transforms[-1], mtx))
+
+	def readDel(self, st):
+		# DEL n - removes the last n transformations, DEL TOP removes all.
+		tok = st.get_token()
+		if (tok.upper() == 'TOP'):
+			n = len(self.transforms)
+		else:
+			try:
+				n = int(tok) if (tok) else 1
+			except ValueError:
+				Console.PrintWarning("Can't evaluate 'DEL %s' - ignored!\n" %(tok))
+				return
+		del self.transforms[max(1, len(self.transforms) - n):]
+
+	def readGlobal(self, st):
+		# GLOB_LAYER = "name"
+		st.get_token() # skip '='
+		return st.get_token()[1:-1]
+
+	def execute(self, doc, tok, args):
+		if (tok == '!'):
+			self.readComment(args)
+			return
+		st = GsmTokens(args)
+		if   (tok == 'BASE'):      self.readBase(st)
+		elif (tok == 'BODY'):      self.readBody(st, doc)
+		elif (tok == 'COOR'):      pass
+		elif (tok == 'DEFINE'):    self.readDefine(st)
+		elif (tok == 'ELSE'):      pass
+		elif (tok == 'ENDIF'):     pass
+		elif (tok == 'hotspot'):   pass
+		elif (tok == 'IF'):        pass
+		elif (tok == 'material'):  self.readMaterial(st)
+		elif (tok.upper() == 'DEL'): self.readDel(st)
+		elif (tok == 'min'):       pass
+		elif (tok.upper() in TRANSFORMATIONS): self.readTransformation(tok.upper(), st)
+		elif (tok == 'RESOL'):     pass # resolution value
+		elif (tok == 'GLOB_HSTORY_HEIGHT'): pass # ???
+		elif (tok == 'GLOB_LAYER'): self.globLayer = self.readGlobal(st) # name of the layer
+		elif (tok == 'GLOB_ID'):    self.globId    = self.readGlobal(st) # id of the object
+		elif (tok == 'GLOB_INTID'): self.globIntId = self.readGlobal(st)
+		elif (tok == 'cPRISM_'):   self.readCPrism(doc, st)
+		elif (tok == 'MODEL'):     self.readModel(st)
+		elif (tok == 'PEN'):       pass
+		else:
+			Console.PrintError("ERROR: Unrecognized token '%s'\n" %(tok))
 
 	def read(self, doc, csd3):
 		self.materials = {}
-		self.vertexList = []
-		self.textureList = []
-		self.edgeList = []
-		self.faceList = []
-		lines = csd3.text.splitlines()
+		self.readBase(None)
+		bulk = {'VERT': self.readVertices, 'TEVE': self.readTextureVertices, 'EDGE': self.readEdges, 'PGON': self.readPolygons}
+		groups = [(tok, list(statements)) for tok, statements in groupby(readStatements(csd3.text), itemgetter(0))]
 		progressbar = FreeCAD.Base.ProgressIndicator()
-		progressbar.start("  reading ...", len(lines))
-		glob_layer = ''
-		glob_id    = ''
-		glob_intid = ''
-		name = 'object'
+		progressbar.start("  reading ...", len(groups))
 		try:
-			skip = False
-			i = 0
-			while (i < len(lines)):
-				line = lines[i]
-				if (not skip):
-					progressbar.next()
-					st = shlex.shlex(line.strip())
-					st.wordchars += '.-'
-					st.whitespace += ','
-					tok = st.get_token()
-					if (tok == ''): pass
-					elif (tok == 'BASE'):      self.readBase(st)
-					elif (tok == 'BODY'):      self.readBody(st, doc)
-					elif (tok == 'COOR'):      self.resetMaterial()
-					elif (tok == 'DEFINE'):    self.readDefine(st)
-					elif (tok == 'EDGE'):      self.readEdge(st)
-					elif (tok == 'ELSE'):      self.resetMaterial()
-					elif (tok == 'ENDIF'):     self.resetMaterial()
-					elif (tok == 'hotspot'):   self.resetMaterial()
-					elif (tok == 'IF'):        pass
-					elif (tok == 'material'):  self.readMaterial(st)
-					elif (tok == 'DEL'):       pass # ???
-					elif (tok == 'min'):       pass
-					elif (tok == 'rotx'):      pass # rotation x-axis in degree
-					elif (tok == 'roty'):      pass # rotation y-axis in degree
-					elif (tok == 'rotz'):      pass # rotation z-axis in degree
-					elif (tok == 'ROTX'):      pass # rotation x-axis in degree
-					elif (tok == 'ROTY'):      pass # rotation y-axis in degree
-					elif (tok == 'ROTZ'):      pass # rotation z-axis in degree
-					elif (tok == 'MULX'):      pass # scale x-axis A / value
-					elif (tok == 'MULY'):      pass # scale y-axis B / value
-					elif (tok == 'MULZ'):      pass # scale z-axis C / value
-					elif (tok == 'ADDX'):      pass # move in x-axis direction
-					elif (tok == 'ADDY'):      pass # move in y-axis direction
-					elif (tok == 'ADDZ'):      pass # move in z-axis direction
-					elif (tok == 'RESOL'):     pass # resolution value
-					elif (tok == 'GLOB_HSTORY_HEIGHT'): pass # ???
-					elif (tok == 'GLOB_LAYER'):
-						dummy = st.get_token()
-						glob_layer = st.get_token() # name of the layer
-						glob_layer = glob_layer[1:-1]
-					elif (tok == 'GLOB_ID'):
-						dummy = st.get_token()
-						glob_id = st.get_token() # id of the object
-						glob_id = glob_id[1:-1]
-					elif (tok == 'GLOB_INTID'):
-						dummy = st.get_token()
-						glob_intid = st.get_token() #
-						glob_intid = glob_intid[1:-1]
-					elif (tok == 'cPRISM_'):   line, i = self.readCPrism(doc, lines, i, name)
-					elif (tok == 'MODEL'):     self.readModel(st)
-					elif (tok == 'MUL'):       self.resetMaterial()
-					elif (tok == 'PEN'):       self.resetMaterial()
-					elif (tok == 'PGON'):      self.readPolygon(st)
-					elif (tok == 'TEVE'):      self.readTextureVertex(st)
-					elif (tok == 'VERT'):      self.readVertex(st)
-					elif (tok == '!'):         self.readComment(st)
-					else:
-						if (self.mat_block != 0):
-							st.push_token(tok)
-							self.readDefine(st)
-						else:
-							Console.PrintError("ERROR: Unrecognized token '%s' (mat_block=%d)\n" %(tok, self.mat_block))
-					if (glob_layer):
-						name = glob_layer
-					if (glob_id):
-						name = '%s_%s' %(name, glob_id)
-					if (glob_intid):
-						name = '%s_%s' %(name, glob_intid)
-				try:
-					skip = line[-1] == ','
-				except:
-					skip = False
-				i += 1
-		except Exception as e:
-			Console.PrintError(traceback.format_exc())
-		progressbar.stop()
-
-def read(doc, fileName):
-	with open(fileName, 'rb') as file:
-		setEndianess(LITTLE_ENDIAN)
-		data = file.read()
-		hdr, pos  = readGsmHeader(data)
-		blocks = {}
-		for bHdr in hdr.blocks:
-			block = readGsmBlock(data, bHdr)
-			blocks[bHdr.key] = block
-		reader = GsmReader()
-		reader.read(doc, blocks.get('CSD3'))
+			for tok, statements in groups:
+				progressbar.next()
+				if (tok in bulk):
+					# runs of geometry statements are converted at once
+					values, counts = getValues(tok, [args for tok, args in statements], BULK_STATEMENTS[tok])
+					bulk[tok](values, counts)
+				else:
+					for tok, args in statements:
+						self.execute(doc, tok, args)
+		finally:
+			progressbar.stop()
+
+def read(doc, fileName, mesh_prisms=None):
+	with GsmFile(fileName) as file:
+		csd3 = file.getBlock('CSD3')
+	if (csd3 is None):
+		Console.PrintWarning("File '%s' has no 3D script!\n" %(fileName))
+		return
+	reader = GsmReader(mesh_prisms)
+	reader.read(doc, csd3)
@@ -26,26 +26,42 @@ http://static.lightwave3d.com/sdk/11-6/html/filefmts/lwo2.html
 #     Made edge creation safer.
 # 1.0 (Ken9) First Release
 
-import os, chunk, traceback, FreeCAD, importUtils, Part
-from importUtils import getBytes, getShort, getShorts, getFloat, getFloats, newObject, newGroup, setEndianess, BIG_ENDIAN
-from itertools import groupby
-from triangulate import getTriangles
-from struct import Struct, unpack
+import os, numpy, FreeCAD, importUtils
+from importUtils import getBytes, getShort, getFloat, getFloats, getSpans, getUsedValues, newIndexedObject, newGroup, setTexture, setVertexMap, setEndianess, BIG_ENDIAN
+from iffReader   import IffFile, readChunks, readForm
+from triangulate import getTriangleCorners
+from subdivide   import catmullClark
+from struct import Struct
 
 UNPACK_NAME  = Struct("4s").unpack_from
 UNPACK_LAYER = Struct(">HH").unpack_from
+UNPACK_MAP   = Struct(">4sH").unpack_from
+
+SPLIT_PARTS       = False         # create a separate object for each part (PTAG PART) of a surface
+SUBDIVISION_LEVEL = 0             # Catmull-Clark steps for SUBD/PTCH/PCHS polygons, 0 imports the cages
+EDGE_WEIGHT       = "Edge Weight" # name of the WGHT maps with the Catmull-Clark edge weights
+MORPH_TARGET      = None          # name of the MORF/SPOT map applied to the points
+MORPH_WEIGHT      = 1.0           # blend factor for the morph target
+
+# vertex map types attached to the mesh objects and the prefix of their properties
+VMAP_PREFIXES = {b'TXUV': 'UV', b'WGHT': 'Weight', b'MORF': 'Morph', b'SPOT': 'Morph'}
 
-V = FreeCAD.Vector
 class Layer(object):
 	def __init__(self):
-		self.name      = ""
-		self.index     = -1
-		self.parentIdx = None
-		self.pivot     = [0, 0, 0]
-		self.pols      = []
-		self.pnts      = []
-		self.surf_tags = {}
-		self.subds     = []
+		self.name        = ""
+		self.index       = -1
+		self.parentIdx   = None
+		self.pivot       = [0, 0, 0]
+		self.pols        = numpy.zeros(0, numpy.int32)           # point indices of all polygons
+		self.pol_offsets = numpy.zeros(1, numpy.int64)           # start of each polygon in pols (+ end)
+		self.pnts        = numpy.zeros((0, 3), numpy.float32)
+		self.surf_tags   = numpy.zeros(0, numpy.int32)           # tag index of each polygon's surface
+		self.part_tags   = numpy.zeros(0, numpy.int32)           # tag index of each polygon's part
+		self.pol_subds   = numpy.zeros(0, bool)                  # polygon is a subdivision cage
+		self.has_subds   = False
+		self.vmaps       = {}                                    # (type, name) -> (points, values) of VMAP
+		self.vmads       = {}                                    # (type, name) -> (polygons, points, values) of VMAD
+		self.subds       = []
 
 class Material(object):
 	def __init__(self):
@@ -64,124 +80,129 @@ class Material(object):
 		self.shrp   = 0.0   # Diffuse Sharpness
 		self.smooth = False  # Surface Smoothing
 
-def read(doc, filename):
+def read(doc, filename, split_parts = None, subdivision_level = None, morph_target = None, morph_weight = None):
 	'''
 	Read the LWO file, hand off to version specific function.
+	split_parts:       create one object per surface and part instead of one per surface.
+	subdivision_level: number of Catmull-Clark steps applied to subdivision polygons.
+	morph_target:      name of the morph map (MORF or SPOT) to import the points for.
+	morph_weight:      blend factor for the morph target.
+	Options that aren't given are taken from the module constants at call time.
+	Returns a dictionary with the list of created mesh objects for each layer index.
 	'''
-	file = open(filename, 'rb')
-
-	try:
-		setEndianess(BIG_ENDIAN)
-		header, chunk_size, chunk_name = unpack(">4s1L4s", file.read(12))
-		layers = {}
-		surfs  = {}
-		tags   = []
-		# Gather the object data using the version specific handler.
-		if chunk_name in (b'LWOB', b'LWLO'):
-			FreeCAD.Console.PrintMessage("Importing LWO v1: %s\n" %(filename))
-			readLwo1(file, filename, layers, surfs, tags)
-		elif chunk_name == b'LWO2':
-			FreeCAD.Console.PrintMessage("Importing LWO v2: %s\n" %(filename))
-			readLwo2(file, filename, layers, surfs, tags)
-		else:
-			FreeCAD.Console.PrintError("Not a supported file type!")
-			file.close()
-			return
-
-		file.close()
-
-		# With the data gathered, build the object(s).
-		buildObjects(doc, layers, surfs, tags)
-
-		layers = None
-		surfs.clear()
-		tags = None
-
-	except:
-		FreeCAD.Console.PrintError(traceback.format_exc())
-		file.close()
-	return
+	if (split_parts is None):       split_parts       = SPLIT_PARTS
+	if (subdivision_level is None): subdivision_level = SUBDIVISION_LEVEL
+	if (morph_target is None):      morph_target      = MORPH_TARGET
+	if (morph_weight is None):      morph_weight      = MORPH_WEIGHT
+	objects = {}
+
+	setEndianess(BIG_ENDIAN)
+	layers = {}
+	surfs  = {}
+	tags   = []
+	with IffFile(filename) as file:
+		if (not readObjectData(file.data, filename, layers, surfs, tags)):
+			return objects
+
+	if (morph_target):
+		if (sum([applyMorph(layer, morph_target, morph_weight) for layer in layers.values()]) == 0):
+			FreeCAD.Console.PrintWarning("Morph target '%s' not found!\n" %(morph_target))
+
+	if (subdivision_level > 0):
+		for layer in layers.values():
+			subdivideLayer(layer, subdivision_level)
+
+	# With the data gathered, build the object(s).
+	objects = buildObjects(doc, layers, surfs, tags, split_parts)
+
+	layers = None
+	surfs.clear()
+	tags = None
+	return objects
+
+def readObjectData(data, filename, layers, surfs, tags):
+	'''
+	Gather the object data using the version specific handler. The chunks
+	are views on data, they are released on return.
+	Returns False if the data isn't a supported LWO file.
+	'''
+	chunk_name, form = readForm(data)
+	if chunk_name in (b'LWOB', b'LWLO'):
+		FreeCAD.Console.PrintMessage("Importing LWO v1: %s\n" %(filename))
+		readLwo1(form, filename, layers, surfs, tags)
+	elif chunk_name == b'LWO2':
+		FreeCAD.Console.PrintMessage("Importing LWO v2: %s\n" %(filename))
+		readLwo2(form, filename, layers, surfs, tags)
+	else:
+		FreeCAD.Console.PrintError("Not a supported file type!")
+		return False
+	return True
 
-def readLwo1(file, filename, layers, surfs, tags):
+def readLwo1(form, filename, layers, surfs, tags):
 	'''
 	Read version 1 file, LW < 6.
 	'''
 	last_pols_count = 0
 	layer = None
 
-	while True:
-		try:
-			rootchunk = chunk.Chunk(file)
-		except EOFError:
-			break
-
-		if rootchunk.chunkname == b'SRFS':
-			readTags(rootchunk.read(), tags)
-		elif rootchunk.chunkname == b'LAYR':
-			layer = readLayr1(rootchunk.read(), layers)
-		elif rootchunk.chunkname == b'PNTS':
+	for chunkname, data in readChunks(form):
+		if chunkname == b'SRFS':
+			readTags(data.tobytes(), tags)
+		elif chunkname == b'LAYR':
+			layer = readLayr1(data.tobytes(), layers)
+		elif chunkname == b'PNTS':
 			if (layer is None):
 				# LWOB files have no LAYR chunk to set this up.
 				layer = Layer()
 				layer.nam = "Layer 1"
 				layer.index = len(layers)
 				layers[layer.index] = layer
-			readPoints(rootchunk.read(), layer)
-		elif rootchunk.chunkname == b'POLS':
-			last_pols_count = readPols1(rootchunk.read(), layer)
-		elif rootchunk.chunkname == b'PCHS':
-			last_pols_count = readPols1(rootchunk.read(), layer)
+			readPoints(data, layer)
+		elif chunkname == b'POLS':
+			last_pols_count = readPols1(data, layer)
+		elif chunkname == b'PCHS':
+			last_pols_count = readPols1(data, layer, True)
 			layer.has_subds = True
-		elif rootchunk.chunkname == b'PTAG':
-			tag_type, = UNPACK_NAME(rootchunk.read(4))
+		elif chunkname == b'PTAG':
+			tag_type, = UNPACK_NAME(data)
 			if tag_type == b'SURF':
-				readSurfTags(rootchunk.read(), layer, last_pols_count)
-			else:
-				rootchunk.skip()
-		elif rootchunk.chunkname == b'SURF':
-			readSurf1(rootchunk.read(), surfs)
-		else:
-			rootchunk.skip()
+				readPolyTags(data[4:], layer.surf_tags, last_pols_count)
+		elif chunkname == b'SURF':
+			readSurf1(data.tobytes(), surfs)
 
-def readLwo2(file, filename, layers, surfs, tags):
+def readLwo2(form, filename, layers, surfs, tags):
 	'''
 	Read version 2 file, LW 6+.
 	'''
 	last_pols_count = 0
 	layer = None
 
-	while True:
-		try:
-			rootchunk = chunk.Chunk(file)
-		except EOFError:
-			break
-
-		if rootchunk.chunkname == b'TAGS':
-			readTags(rootchunk.read(), tags)
-		elif rootchunk.chunkname == b'BBOX':
-			rootchunk.skip()
-		elif rootchunk.chunkname == b'LAYR':
-			layer = readLayr2(rootchunk.read(), layers)
-		elif rootchunk.chunkname == b'PNTS':
-			readPoints(rootchunk.read(), layer)
-		elif rootchunk.chunkname == b'POLS':
-			sub_type = rootchunk.read(4)
+	for chunkname, data in readChunks(form):
+		if chunkname == b'TAGS':
+			readTags(data.tobytes(), tags)
+		elif chunkname == b'LAYR':
+			layer = readLayr2(data.tobytes(), layers)
+		elif chunkname == b'PNTS':
+			readPoints(data, layer)
+		elif chunkname == b'POLS':
+			sub_type, = UNPACK_NAME(data)
 			# PTCH is LW's Subpatches, SUBD is CatmullClark.
 			if (sub_type in (b'FACE', b'PTCH', b'SUBD')):
-				last_pols_count = readPols2(rootchunk.read(), layer)
-				if sub_type == b'FACE':
+				last_pols_count = readPols2(data[4:], layer, sub_type != b'FACE')
+				if sub_type != b'FACE':
 					layer.has_subds = True
-				rootchunk.skip()
-		elif rootchunk.chunkname == b'PTAG':
-			sub_type, = UNPACK_NAME(rootchunk.read(4))
+		elif chunkname == b'PTAG':
+			sub_type, = UNPACK_NAME(data)
 			if sub_type == b'SURF':
-				readSurfTags(rootchunk.read(), layer, last_pols_count)
-			else:
-				rootchunk.skip()
-		elif rootchunk.chunkname == b'SURF':
-			readSurf2(rootchunk.read(), surfs)
-		else:
-			rootchunk.skip()
+				readPolyTags(data[4:], layer.surf_tags, last_pols_count)
+			elif sub_type == b'PART':
+				readPolyTags(data[4:], layer.part_tags, last_pols_count)
+		elif chunkname == b'VMAP':
+			readVMap(data, layer)
+		elif chunkname == b'VMAD':
+			readVMad(data, layer, last_pols_count)
+		elif chunkname == b'SURF':
+			readSurf2(data.tobytes(), surfs)
 
 def readString(raw_name):
 	'''
@@ -199,13 +220,70 @@ def readString(raw_name):
 
 	return name, name_len
 
-def readVX(pointdata):
+def readVX(data, offset):
 	'''
 	Read a variable-length index.
 	'''
-	if pointdata[0] != 255:
-		return pointdata[0] * 256 + pointdata[1], 2
-	return pointdata[1]*65536 + pointdata[2]*256 + pointdata[3], 4
+	if data[offset] != 255:
+		return data[offset] * 256 + data[offset + 1], offset + 2
+	return data[offset + 1]*65536 + data[offset + 2]*256 + data[offset + 3], offset + 4
+
+def getRecordStarts(nxt):
+	'''
+	Returns the start positions of a sequence of variable sized records.
+	nxt[i] is the position of the following record if a record starts at i.
+	Instead of walking the records one by one the chain starting at 0 is
+	followed by pointer doubling: after each round the known part of the
+	chain and the jump width are doubled.
+	'''
+	n = len(nxt)
+	if (n == 0): return numpy.zeros(0, numpy.int64)
+	stride = nxt[0]
+	if ((n % stride == 0) and (nxt[::stride] == numpy.arange(stride, n + stride, stride)).all()):
+		return numpy.arange(0, n, stride, dtype=numpy.int64) # all records have the same size
+	jump = numpy.empty(n + 1, numpy.int64)
+	numpy.minimum(nxt, n, out=jump[:n])
+	jump[n] = n
+	starts = numpy.zeros(1, numpy.int64)
+	while (True):
+		following = jump[starts]
+		following = following[following < n]
+		starts = numpy.concatenate((starts, following))
+		if (len(following) < len(starts) - len(following)): break # reached the end of the chain
+		jump = jump[jump]
+	return starts
+
+def readVXRecords(data, numVX, tail):
+	'''
+	Read records made of numVX variable-length indices followed by tail bytes.
+	Returns the (n, numVX) array of indices and the (n, tail) array of the remaining bytes.
+	'''
+	raw  = numpy.frombuffer(data, numpy.uint8)
+	size = 2 * numVX + tail
+	if (len(raw) % size == 0):
+		rec = raw.reshape((-1, size))
+		if (not (rec[:, 0:2 * numVX:2] == 0xFF).any()):
+			# all indices are stored with 2 bytes => fixed sized records.
+			vx = (rec[:, 0:2 * numVX:2].astype(numpy.int32) << 8) | rec[:, 1:2 * numVX:2]
+			return vx, rec[:, 2 * numVX:]
+	# 4 byte indices are present => single pass scanner
+	vx = []
+	tails = []
+	offset = 0
+	while (offset + size <= len(raw)):
+		for i in range(numVX):
+			idx, offset = readVX(data, offset)
+			vx.append(idx)
+		tails.append(offset)
+		offset += tail
+	tails = numpy.array(tails, numpy.int64)
+	return numpy.array(vx, numpy.int32).reshape((-1, numVX)), raw[tails[:, None] + numpy.arange(tail)]
+
+def getValues(tails, dtype):
+	'''
+	Interprets the remaining record bytes returned by readVXRecords as values of dtype.
+	'''
+	return numpy.ascontiguousarray(tails).view(dtype)
 
 def readTags(tag_bytes, objTags):
 	'''
@@ -271,82 +349,313 @@ def readPoints(pnt_bytes, layer):
 	Read the layer's points.
 	'''
 #	FreeCAD.Console.PrintMessage("  Reading Layer Points\n")
-	offset = 0
-	chunk_len = len(pnt_bytes)
+	count = len(pnt_bytes) // 12
+	# Re-order the points so that the mesh has the right pitch,
+	# the pivot already has the correct order.
+	pnts = numpy.frombuffer(pnt_bytes, '>f4', 3 * count).reshape((count, 3))[:, (0, 2, 1)] - numpy.array(layer.pivot, numpy.float32)
+	layer.pnts = numpy.concatenate((layer.pnts, pnts))
 
-	while offset < chunk_len:
-		pnts, offset = getFloats(pnt_bytes, offset, 3)
-		# Re-order the points so that the mesh has the right pitch,
-		# the pivot already has the correct order.
-		pnts = [pnts[0] - layer.pivot[0],\
-			   pnts[2] - layer.pivot[1],\
-			   pnts[1] - layer.pivot[2]]
-		layer.pnts.append(pnts)
-
-def readPols1(pols, layer):
+def addPolygons(layer, indices, offsets, surf_tags, subd):
+	'''
+	Append the polygons of a POLS chunk to the layer and return their count.
+	'''
+	layer.pol_offsets = numpy.concatenate((layer.pol_offsets, offsets[1:] + len(layer.pols)))
+	layer.pols        = numpy.concatenate((layer.pols, indices))
+	layer.surf_tags   = numpy.concatenate((layer.surf_tags, surf_tags))
+	untagged          = numpy.full(len(surf_tags), -1, numpy.int32)
+	layer.part_tags   = numpy.concatenate((layer.part_tags, untagged))
+	layer.pol_subds   = numpy.concatenate((layer.pol_subds, numpy.full(len(surf_tags), subd)))
+	return len(offsets) - 1
+
+def readPols1(pols, layer, subd = False):
 	'''
 	Read the polygons, each one is just a list of point indexes.
 	But it also includes the surface index (sid).
 	'''
 #	FreeCAD.Console.PrintMessage("  Reading Layer Polygons\n")
-	pol_bytes = bytearray(pols)
+	count = len(pols) // 2
+	words = numpy.frombuffer(pols, '>u2', count).astype(numpy.int64)
+	sids  = numpy.frombuffer(pols, '>i2', count)
+	pos   = numpy.arange(count)
+	# U2 count, count * U2 index, I2 sid [, U2 number of detail polygons if sid < 0]
+	sid_pos = numpy.minimum(pos + 1 + words, count - 1)
+	starts  = getRecordStarts(pos + 2 + words + (sids[sid_pos] < 0))
+	counts  = words[starts]
+	if (len(starts) > 0) and (starts[-1] + 2 + counts[-1] > count):
+		starts, counts = starts[:-1], counts[:-1] # truncated polygon
+	spans, offsets = getSpans(starts + 1, counts)
+	surf_tags = numpy.abs(sids[starts + 1 + counts].astype(numpy.int32)) - 1
+	return addPolygons(layer, words[spans].astype(numpy.int32), offsets, surf_tags, subd)
+
+def scanPols2(pol_bytes):
+	'''
+	Single pass over polygons with 4 byte variable-length indices.
+	'''
+	indices = []
+	offsets = [0]
 	offset = 0
 	chunk_len = len(pol_bytes)
-	old_pols_count = len(layer.pols)
-	poly = 0
 
-	while offset < chunk_len:
-		pnts_count, offset = getShort(pol_bytes, offset)
-		all_face_pnts, offset = getShorts(pol_bytes, offset, pnts_count)
-		layer.pols.append(all_face_pnts)
-		sid, offset = getShort(pol_bytes, offset)
-		sid = abs(sid) - 1
-		if sid not in layer.surf_tags:
-			layer.surf_tags[sid] = []
-		layer.surf_tags[sid].append(poly)
-		poly += 1
+	while offset + 2 <= chunk_len:
+		pnts_count = (pol_bytes[offset] * 256 + pol_bytes[offset + 1]) & 0x03FF
+		offset += 2
+		for j in range(pnts_count):
+			face_pnt, offset = readVX(pol_bytes, offset)
+			indices.append(face_pnt)
+		offsets.append(len(indices))
 
-	return len(layer.pols) - old_pols_count
+	return numpy.array(indices, numpy.int32), numpy.array(offsets, numpy.int64)
 
-def readPols2(pols, layer):
+def readPols2(pols, layer, subd = False):
 	'''
 	Read the layer's polygons, each one is just a list of point indexes.
 	'''
 #	FreeCAD.Console.PrintMessage("  Reading Layer Polygons\n")
-	offset = 0
-	pol_bytes = bytearray(pols)
-	chunk_len = len(pol_bytes)
-	old_pols_count = len(layer.pols)
+	count = len(pols) // 2
+	words = numpy.frombuffer(pols, '>u2', count)
+	# U2 flags (6 bits) & count (10 bits), count * VX index
+	counts = (words & 0x03FF).astype(numpy.int64)
+	starts = getRecordStarts(numpy.arange(count) + 1 + counts)
+	counts = counts[starts]
+	if (len(starts) > 0) and (starts[-1] + 1 + counts[-1] > count):
+		starts, counts = starts[:-1], counts[:-1] # truncated polygon
+	spans, offsets = getSpans(starts + 1, counts)
+	indices = words[spans]
+	if ((indices >> 8) == 0xFF).any():
+		# Words are only valid as long as all indices are stored with 2 bytes.
+		indices, offsets = scanPols2(pols)
+	return addPolygons(layer, indices.astype(numpy.int32), offsets, numpy.full(len(offsets) - 1, -1, numpy.int32), subd)
+
+def readPolyTags(tags, poly_tags, last_pols_count):
+	'''
+	Read the list of PolyIDs and tag indexes into the per polygon array
+	(surface or part) of the last polygons read.
+	'''
+#	FreeCAD.Console.PrintMessage("  Reading Layer Polygon Tags\n")
+	# Read in the PolyID/Tag Index pairs.
+	pids, tails = readVXRecords(tags, 1, 2)
+	sids = getValues(tails, '>u2')[:, 0]
+	pids = pids[:, 0]
+	valid = pids < last_pols_count
+	abs_pid = len(poly_tags) - last_pols_count
+	poly_tags[pids[valid] + abs_pid] = sids[valid]
+
+def readMapHeader(data):
+	'''
+	Read type, dimension and name of a vertex map.
+	Returns them together with the offset of the first record.
+	'''
+	map_type, dim = UNPACK_MAP(data)
+	end = 6 + int(numpy.argmax(numpy.frombuffer(data, numpy.uint8, offset=6) == 0))
+	name, name_len = readString(data[6:end + 1].tobytes())
+	return map_type, dim, name, 6 + name_len
 
-	while offset < chunk_len:
-		pnts_count, offset = getShort(pol_bytes, offset)
-		all_face_pnts = []
-		for j in range(pnts_count):
-			face_pnt, data_size = readVX(pol_bytes[offset:offset+4])
-			offset += data_size
-			all_face_pnts.append(face_pnt)
+def getMapValues(map_type, tails, dim):
+	'''
+	Interprets the remaining record bytes of a vertex map as (n, dim) floats.
+	'''
+	if (dim == 0):
+		return numpy.zeros((len(tails), 0), numpy.float32)
+	values = getValues(tails, '>f4').reshape((-1, dim)).astype(numpy.float32)
+	if (map_type in (b'MORF', b'SPOT')) and (dim == 3):
+		# Re-order the coordinates the same way as the points.
+		values = values[:, (0, 2, 1)]
+	return values
+
+def addMap(maps, key, arrays):
+	'''
+	Add the arrays of a vertex map, a map spread over several chunks is merged.
+	'''
+	known = maps.get(key)
+	if (known is not None):
+		arrays = tuple(numpy.concatenate((a, b)) for a, b in zip(known, arrays))
+	maps[key] = arrays
 
-		layer.pols.append(all_face_pnts)
+def readVMap(data, layer):
+	'''
+	Read a vertex map (VMAP): dim values for each listed point.
+	'''
+	map_type, dim, name, offset = readMapHeader(data)
+	pnts, tails = readVXRecords(data[offset:], 1, 4 * dim)
+	addMap(layer.vmaps, (map_type, name), (pnts[:, 0], getMapValues(map_type, tails, dim)))
 
-	return len(layer.pols) - old_pols_count
+def readVMad(data, layer, last_pols_count):
+	'''
+	Read a discontinuous vertex map (VMAD): dim values for each listed polygon corner.
+	'''
+	map_type, dim, name, offset = readMapHeader(data)
+	vx, tails = readVXRecords(data[offset:], 2, 4 * dim)
+	pols = vx[:, 1].astype(numpy.int64) + (len(layer.surf_tags) - last_pols_count)
+	addMap(layer.vmads, (map_type, name), (pols, vx[:, 0], getMapValues(map_type, tails, dim)))
 
-def readSurfTags(tags, layer, last_pols_count):
+def applyMorph(layer, name, weight):
 	'''
-	Read the list of PolyIDs and tag indexes.
+	Move the layer's points towards the morph target: MORF maps store the
+	displacement, SPOT maps the absolute position of the points.
+	Returns True if the layer has the morph target.
 	'''
-#	FreeCAD.Console.PrintMessage("  Reading Layer Surface Assignments\n")
-	offset = 0
-	tag_bytes = bytearray(tags)
-	chunk_len = len(tag_bytes)
-	# Read in the PolyID/Surface Index pairs.
-	abs_pid = len(layer.pols) - last_pols_count
-	while offset < chunk_len:
-		pid, pid_len = readVX(tag_bytes[offset:offset+4])
-		offset += pid_len
-		sid, offset = getShort(tag_bytes, offset)
-		if sid not in layer.surf_tags:
-			layer.surf_tags[sid] = []
-		layer.surf_tags[sid].append(pid + abs_pid)
+	for map_type in (b'MORF', b'SPOT'):
+		vmap = layer.vmaps.get((map_type, name))
+		if (vmap is not None):
+			pnts, values = vmap
+			valid = pnts < len(layer.pnts)
+			pnts, values = pnts[valid], values[valid]
+			if (map_type == b'SPOT'):
+				values = values - numpy.array(layer.pivot, numpy.float32) - layer.pnts[pnts]
+			layer.pnts[pnts] += weight * values
+			return True
+	return False
+
+def findCorners(layer, polygons, pnts, pols, corner_pnts):
+	'''
+	Returns the positions of the (polygon, point) pairs of a VMAD in the corner
+	arrays and a mask of the pairs found.
+	'''
+	count = len(layer.pnts)
+	keys  = pols * count + corner_pnts
+	order = numpy.argsort(keys, kind='stable')
+	query = polygons * count + pnts
+	pos   = numpy.minimum(numpy.searchsorted(keys[order], query), len(keys) - 1)
+	found = keys[order][pos] == query
+	return order[pos[found]], found
+
+def getLayerMap(layer, key, dim):
+	'''
+	Returns the values of the map and the index into them for each polygon
+	corner of the layer. The values start with the VMAP value of each point,
+	the VMAD values - which overrule them for single corners - follow.
+	'''
+	values = numpy.zeros((len(layer.pnts), dim), numpy.float32)
+	vmap = layer.vmaps.get(key)
+	if (vmap is not None):
+		ids, data = vmap
+		valid = ids < len(layer.pnts)
+		values[ids[valid]] = data[valid]
+	indices = layer.pols.astype(numpy.int64)
+	vmad = layer.vmads.get(key)
+	if (vmad is not None) and (len(layer.pols) > 0):
+		polygons, ids, data = vmad
+		pols, nxt = getNextCorners(layer.pol_offsets)
+		corners, found = findCorners(layer, polygons, ids, pols, layer.pols)
+		indices[corners] = len(values) + numpy.arange(len(corners))
+		values = numpy.concatenate((values, data[found]))
+	return values, indices
+
+def getNextCorners(offsets):
+	'''
+	Returns the polygon index of each corner and the position of the following corner.
+	'''
+	sizes = numpy.diff(offsets)
+	polygons = numpy.repeat(numpy.arange(len(sizes)), sizes)
+	nxt = numpy.arange(1, offsets[-1] + 1)
+	nxt[offsets[1:][sizes > 0] - 1] = offsets[:-1][sizes > 0]
+	return polygons, nxt
+
+def getEdgeWeights(layer):
+	'''
+	Returns the edge weights as (a, b, weights) arrays, VMAD weights overrule the
+	weights of the VMAP, which apply to edges with weighted points at both ends.
+	'''
+	polygons, nxt = getNextCorners(layer.pol_offsets)
+	a, b, w = [numpy.zeros(0, numpy.int64)], [numpy.zeros(0, numpy.int64)], [numpy.zeros(0, numpy.float64)]
+	vmad = layer.vmads.get((b'WGHT', EDGE_WEIGHT))
+	if (vmad is not None) and (len(layer.pols) > 0):
+		pols, pnts, weights = vmad
+		corners, found = findCorners(layer, pols, pnts, polygons, layer.pols)
+		a.append(layer.pols[corners])
+		b.append(layer.pols[nxt[corners]])
+		w.append(weights[found, 0])
+	vmap = layer.vmaps.get((b'WGHT', EDGE_WEIGHT))
+	if (vmap is not None):
+		pnts, weights = vmap
+		weights = weights[:, 0]
+		valid = pnts < len(layer.pnts)
+		pnt_weights = numpy.full(len(layer.pnts), numpy.nan)
+		pnt_weights[pnts[valid]] = weights[valid]
+		weights = numpy.minimum(pnt_weights[layer.pols], pnt_weights[layer.pols[nxt]])
+		weighted = ~numpy.isnan(weights)
+		a.append(layer.pols[weighted])
+		b.append(layer.pols[nxt][weighted])
+		w.append(weights[weighted])
+	return numpy.concatenate(a), numpy.concatenate(b), numpy.concatenate(w)
+
+def selectPolygons(layer, selection):
+	'''
+	Returns the flat point indices and the offsets of the selected polygons.
+	'''
+	positions, offsets = getSpans(layer.pol_offsets[selection], numpy.diff(layer.pol_offsets)[selection])
+	return layer.pols[positions], offsets
+
+def subdivideLayer(layer, level):
+	'''
+	Replace the subdivision cages (SUBD, PTCH and PCHS polygons) of the layer
+	by their Catmull-Clark subdivision.
+	'''
+	cages = numpy.flatnonzero(layer.pol_subds)
+	if (len(cages) == 0): return
+	FreeCAD.Console.PrintMessage("Subdividing %d polygons of '%s'...\n" %(len(cages), layer.name))
+	faces = numpy.flatnonzero(~layer.pol_subds)
+	cage_pols, cage_offsets = selectPolygons(layer, cages)
+	face_pols, face_offsets = selectPolygons(layer, faces)
+	# The VMAPs are subdivided as additional coordinates of the points, the
+	# last column of each map tells how much of a new point's value is known.
+	count = len(layer.pnts)
+	keys = sorted(layer.vmaps)
+	columns = [layer.pnts]
+	for key in keys:
+		ids, data = layer.vmaps[key]
+		valid = ids < count
+		values = numpy.zeros((count, data.shape[1] + 1), numpy.float32)
+		values[ids[valid], :-1] = data[valid]
+		values[ids[valid], -1] = 1.0
+		columns.append(values)
+	pnts, pols, offsets, polygons = catmullClark(numpy.concatenate(columns, axis=1), cage_pols, cage_offsets, level, getEdgeWeights(layer))
+	vmaps = {}
+	start = 3
+	for key in keys:
+		ids, data = layer.vmaps[key]
+		dim = data.shape[1]
+		known = pnts[:, start + dim]
+		new = numpy.flatnonzero(known > 1e-6)
+		values = pnts[new, start:start + dim] / known[new, None]
+		vmaps[key] = (numpy.concatenate((ids, count + new)), numpy.concatenate((data, values.astype(numpy.float32))))
+		start += dim + 1
+	pnts = pnts[:, 0:3]
+	# The VMADs of the faces are kept, the polygons of the cages are replaced.
+	vmads = {}
+	dropped = 0
+	for key, (vpols, vpnts, data) in layer.vmads.items():
+		kept = numpy.isin(vpols, faces)
+		dropped += len(kept) - numpy.count_nonzero(kept)
+		vmads[key] = (numpy.searchsorted(faces, vpols[kept]), vpnts[kept], data[kept])
+	if (dropped > 0):
+		FreeCAD.Console.PrintWarning("%d discontinuous map values (VMAD) of the subdivided polygons of '%s' are dropped!\n" %(dropped, layer.name))
+
+	# The faces keep their points, the subdivided polygons are appended.
+	parents = numpy.concatenate((faces, cages[polygons]))
+	layer.pols        = numpy.concatenate((face_pols, pols + len(layer.pnts))).astype(numpy.int32)
+	layer.pol_offsets = numpy.concatenate((face_offsets, offsets[1:] + face_offsets[-1]))
+	layer.pnts        = numpy.concatenate((layer.pnts, pnts.astype(numpy.float32)))
+	layer.surf_tags   = layer.surf_tags[parents]
+	layer.part_tags   = layer.part_tags[parents]
+	layer.pol_subds   = numpy.zeros(len(parents), bool)
+	layer.vmaps       = vmaps
+	layer.vmads       = vmads
+	compactPoints(layer) # the cages' points are replaced by the subdivided ones
+
+def compactPoints(layer):
+	'''
+	Drops the points no polygon refers to, together with their map values.
+	'''
+	used, pols = numpy.unique(layer.pols, return_inverse=True)
+	layer.pnts = layer.pnts[used]
+	layer.pols = pols.reshape(-1).astype(numpy.int32)
+	for key, (ids, data) in layer.vmaps.items():
+		kept = numpy.isin(ids, used)
+		layer.vmaps[key] = (numpy.searchsorted(used, ids[kept]), data[kept])
+	for key, (vpols, vpnts, data) in layer.vmads.items():
+		kept = numpy.isin(vpnts, used)
+		layer.vmads[key] = (vpols[kept], numpy.searchsorted(used, vpnts[kept]), data[kept])
 
 def readSurf1(surf_bytes, objMaterials):
 	'''
@@ -440,61 +749,115 @@ def readSurf2(surf_bytes, objMaterials):
 
 	objMaterials[surf.name] = surf
 
-def buildObject(doc, parent, layer, objMaterials, objTags):
+def getSurfaceGroups(layer, polygons, split_parts):
+	'''
+	Sort the triangles by the surface (and part) of their polygons.
+	Returns a list of (surf_tag, part_tag, triangle indices) per group.
+	'''
+	surfs = layer.surf_tags[polygons].astype(numpy.int64)
+	if (split_parts):
+		parts = layer.part_tags[polygons].astype(numpy.int64)
+	else:
+		parts = numpy.full(len(polygons), -1, numpy.int64)
+	# tags are U2 or -1, so (surf, part) fits into one sortable key.
+	keys  = (surfs + 1) * 0x10001 + (parts + 1)
+	order = numpy.argsort(keys, kind='stable')
+	keys  = keys[order]
+	bounds = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+	return [(surfs[tris[0]], parts[tris[0]], tris) for tris in numpy.split(order, bounds) if (len(tris) > 0)]
+
+def getTagName(objTags, tag):
+	if (tag >= 0) and (tag < len(objTags)):
+		return objTags[tag]
+	return None
+
+def adjustMaterial(me, material):
+	if (not me.ViewObject): return # no GUI
+#	me.ViewObject.ShapeMaterial.AmbientColor  =
+	me.ViewObject.ShapeMaterial.DiffuseColor  = material.colr
+#	me.ViewObject.ShapeMaterial.EmissiveColor =
+#	me.ViewObject.ShapeMaterial.SpecularColor =
+	me.ViewObject.ShapeMaterial.Shininess     = material.lumi
+	me.ViewObject.ShapeMaterial.Transparency  = material.trnl
+
+def getLayerMaps(layer):
+	'''
+	Returns the (values, corner indices) of each vertex map of the layer.
+	'''
+	maps = {}
+	for key, vmap in list(layer.vmaps.items()) + list(layer.vmads.items()):
+		if ((key[0] in VMAP_PREFIXES) and (key not in maps)):
+			maps[key] = getLayerMap(layer, key, vmap[-1].shape[1])
+	return maps
+
+def setVertexMaps(me, maps, corners):
+	'''
+	Attach the vertex maps to the mesh object for the facet corners given as
+	(m, 3) array of the layer's corner positions. The first UV map becomes
+	the object's texture coordinates.
+	'''
+	uvs = None
+	for key in sorted(maps):
+		map_type, name = key
+		values, indices = maps[key]
+		if (map_type == b'TXUV') and (uvs is None):
+			uvs = values
+			setTexture(me, values, indices[corners], None)
+		else:
+			setVertexMap(me, VMAP_PREFIXES[map_type], name, values, indices[corners])
+
+def buildObject(doc, parent, layer, objMaterials, objTags, split_parts, objects):
 	FreeCAD.Console.PrintMessage("Building mesh '%s'...\n" %(layer.name))
-	data = []
-	mfacets = []
-	if (layer.pols):
-		for pol in layer.pols:
-			ngon = [layer.pnts[idx] for idx in pol]
-			points = [V(k) for k in ngon]
-			points.append(points[0])
-			if len(ngon) > 2:
-				wire = Part.makePolygon(points)
-				plane = wire.findPlane(0.00001)
-				points2 =  [plane.projectPoint(p) for p in points]
-				wire = Part.makePolygon(points2)
-				try:
-					face = Part.Face(wire)
-					tris = face.tessellate(0.1)
-					for tri in tris[1]:
-						data.append([tris[0][i] for i in tri])
-				except Exception as e:
-					Part.show(wire)
-					FreeCAD.Console.PrintWarning("   skipping polygon (%s): %s\n"%(e, ngon))
-
-	me = newObject(doc, layer.name, data)
-	me.Placement.Base = FreeCAD.Vector(layer.pivot)
-
-	# Create the Material Slots and assign the MatIndex to the correct faces.
-	for surf_key in layer.surf_tags:
-		if objTags[surf_key] in objMaterials:
-			material = objMaterials[objTags[surf_key]]
-#			me.ViewObject.ShapeMaterial.AmbientColor  =
-			me.ViewObject.ShapeMaterial.DiffuseColor  = material.colr
-#			me.ViewObject.ShapeMaterial.EmissiveColor =
-#			me.ViewObject.ShapeMaterial.SpecularColor =
-			me.ViewObject.ShapeMaterial.Shininess     = material.lumi
-			me.ViewObject.ShapeMaterial.Transparency  = material.trnl
-
-	# Clear out the dictionaries for this layer.
-	layer.surf_tags.clear()
+	corners, polygons = getTriangleCorners(layer.pnts, layer.pols, layer.pol_offsets)
+	groups = getSurfaceGroups(layer, polygons, split_parts)
+	maps   = getLayerMaps(layer)
+
+	# Create one object for each surface (and part) with the surface's material.
+	meshes = []
+	for surf_tag, part_tag, tris in groups:
+		surf_name = getTagName(objTags, surf_tag)
+		part_name = getTagName(objTags, part_tag)
+		name = layer.name
+		if (len(groups) > 1):
+			name = "%s_%s" %(name, surf_name or "Default")
+			if (part_name):
+				name = "%s_%s" %(name, part_name)
+		pnts, facets = getUsedValues(layer.pnts, layer.pols[corners[tris]]) # only the group's points
+		me = newIndexedObject(doc, name, pnts, facets)
+		me.Placement.Base = FreeCAD.Vector(layer.pivot)
+		setVertexMaps(me, maps, corners[tris])
+		if (surf_name in objMaterials):
+			adjustMaterial(me, objMaterials[surf_name])
+		meshes.append(me)
+	if (len(meshes) == 0):
+		me = newIndexedObject(doc, layer.name, layer.pnts, numpy.zeros((0, 3), numpy.int32))
+		me.Placement.Base = FreeCAD.Vector(layer.pivot)
+		meshes.append(me)
+	objects[layer.index] = meshes
+
+	# Clear out the arrays for this layer.
+	layer.surf_tags = None
+	layer.part_tags = None
+	layer.vmaps     = {}
+	layer.vmads     = {}
 	if (len(layer.subds) == 0):
 		if (parent is not None):
-			parent.Shapes.append(me)
+			parent.Shapes.extend(meshes)
 	else:
 		group = newGroup(doc, layer.name)
-		group.Shapes.append(me)
+		group.Shapes.extend(meshes)
 		if (parent is not None):
 			parent.Shapes.append(group)
 		for child in layer.subds:
-			buildObject(doc, group, child, objMaterials, objTags)
+			buildObject(doc, group, child, objMaterials, objTags, split_parts, objects)
 
-def buildObjects(doc, layers, objMaterials, objTags):
+def buildObjects(doc, layers, objMaterials, objTags, split_parts):
 	'''
 	Using the gathered data, create the objects.
 	'''
+	objects = {}
 	for key,layer in layers.items():
 		if (layer.parentIdx is None):
-			buildObject(doc, None, layer, objMaterials, objTags)
+			buildObject(doc, None, layer, objMaterials, objTags, split_parts, objects)
 	FreeCAD.Console.PrintMessage("Done Importing LWO File\n")
+	return objects
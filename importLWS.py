@@ -0,0 +1,184 @@
+# -*- coding: utf8 -*-
+
+__title__   = "Import LightWave Scenes"
+__author__  = "Jens M. Plonka"
+__url__     = "https://www.github.com/jmplonka/Importer3D"
+'''
+Imports a LWS file.
+http://static.lightwave3d.com/sdk/11-6/html/filefmts/lwsc.html
+'''
+
+import os, re, FreeCAD, importLWO
+from math        import radians, degrees
+from importUtils import getValidName, findFile
+
+ITEM_ID = re.compile('^([0-9A-Fa-f]{8})\\s+(.*)$')
+CHANNEL = ('position', 0), ('position', 1), ('position', 2), ('rotation', 0), ('rotation', 1), ('rotation', 2), ('scale', 0), ('scale', 1), ('scale', 2)
+
+class SceneItem(object):
+	def __init__(self, index):
+		self.index    = index
+		self.fileName = None       # None for null objects
+		self.layer    = 1
+		self.name     = ""
+		self.parent   = None       # index of the parent item
+		self.position = [0.0, 0.0, 0.0]
+		self.rotation = [0.0, 0.0, 0.0] # heading, pitch, bank
+		self.scale    = [1.0, 1.0, 1.0]
+		self.pivot    = [0.0, 0.0, 0.0]
+		self.world    = None       # (placement, scale) in the scene
+
+def readLines(filename):
+	'''
+	Yields the keyword and the remaining text of each non-empty line.
+	'''
+	with open(filename, 'r', encoding='latin1') as file:
+		for line in file:
+			line = line.strip()
+			if (line):
+				words = line.split(None, 1)
+				yield words[0], words[1] if (len(words) > 1) else ""
+
+def setChannel(item, channel, value):
+	if (channel is not None) and (channel < len(CHANNEL)):
+		attr, idx = CHANNEL[channel]
+		getattr(item, attr)[idx] = value
+
+def readMotion1(lines, item):
+	'''
+	Read the motion of LW < 6 scenes: the first key of all channels in one line.
+	'''
+	channels = int(next(lines)[0])
+	keys = int(next(lines)[0])
+	if (keys > 0):
+		key, values = next(lines)
+		values = [float(v) for v in ([key] + values.split())[:channels]]
+		for channel, value in enumerate(values):
+			setChannel(item, channel, value)
+
+def readScene(filename):
+	'''
+	Read the scene's object items. Only the first key of each motion channel is used.
+	'''
+	lines = readLines(filename)
+	tag, version = next(lines)
+	if (tag != 'LWSC'):
+		raise ValueError("Not a LightWave scene file!")
+	version = int(next(lines)[0])
+	items   = []
+	item    = None
+	channel = None
+	for key, value in lines:
+		if (key in ('LoadObjectLayer', 'LoadObject', 'AddNullObject')):
+			item = SceneItem(len(items))
+			items.append(item)
+			channel = None
+			if (key == 'LoadObjectLayer'):
+				layer, value = value.split(None, 1)
+				item.layer = int(layer)
+				match = ITEM_ID.match(value)
+				if (match): value = match.group(2)
+				item.fileName = value
+			elif (key == 'LoadObject'):
+				item.fileName = value
+			else:
+				match = ITEM_ID.match(value)
+				item.name = match.group(2) if (match) else value
+		elif (key in ('AddLight', 'AddCamera', 'AddBone')):
+			item = None # only objects are imported
+		elif (item is not None):
+			if (key == 'ObjectMotion') and (version < 3):
+				readMotion1(lines, item)
+			elif (key == 'Channel'):
+				channel = int(value)
+			elif (key == 'Key') and (channel is not None):
+				setChannel(item, channel, float(value.split()[0]))
+				channel = None # only the first key is used
+			elif (key == 'PivotPosition'):
+				item.pivot = [float(v) for v in value.split()[:3]]
+			elif (key == 'ParentItem'):
+				parent = int(value, 16)
+				if ((parent >> 28) == 1): item.parent = parent & 0x0FFFFFFF # objects only
+			elif (key == 'ParentObject'):
+				item.parent = int(value) - 1
+	if (version < 3):
+		# older versions store the angles in degrees
+		for item in items:
+			item.rotation = [radians(a) for a in item.rotation]
+	return items
+
+def getLocal(item):
+	'''
+	Converts the item's motion into FreeCAD's coordinate system: LightWave is
+	left handed with Y up, so Y and Z are swapped (like the LWO points) and
+	the rotations are mirrored.
+	'''
+	h, p, b = [degrees(a) for a in item.rotation]
+	rotation = FreeCAD.Rotation(FreeCAD.Vector(0, 0, 1), -h)
+	rotation = rotation.multiply(FreeCAD.Rotation(FreeCAD.Vector(1, 0, 0), -p))
+	rotation = rotation.multiply(FreeCAD.Rotation(FreeCAD.Vector(0, 1, 0), -b))
+	scale = FreeCAD.Vector(item.scale[0], item.scale[2], item.scale[1])
+	pivot = FreeCAD.Vector(item.pivot[0] * scale.x, item.pivot[2] * scale.y, item.pivot[1] * scale.z)
+	position = FreeCAD.Vector(item.position[0], item.position[2], item.position[1])
+	return FreeCAD.Placement(position - rotation.multVec(pivot), rotation), scale
+
+def getWorld(items, item):
+	'''
+	Returns the placement and scale of the item in the scene.
+	'''
+	if (item.world is None):
+		placement, scale = getLocal(item)
+		if (item.parent is not None) and (item.parent < len(items)) and (item.parent != item.index):
+			item.world = (FreeCAD.Placement(), FreeCAD.Vector(1, 1, 1)) # breaks cyclic references
+			parentPlacement, parentScale = getWorld(items, items[item.parent])
+			placement.Base = FreeCAD.Vector(placement.Base.x * parentScale.x, placement.Base.y * parentScale.y, placement.Base.z * parentScale.z)
+			placement = parentPlacement.multiply(placement)
+			scale = FreeCAD.Vector(scale.x * parentScale.x, scale.y * parentScale.y, scale.z * parentScale.z)
+		item.world = (placement, scale)
+	return item.world
+
+def getPrototype(doc, cache, sceneName, item):
+	'''
+	Each object file is read once, each of its layers becomes a hidden
+	App::Part that is shared by all scene items referencing the layer.
+	'''
+	path = findFile(sceneName, item.fileName)
+	if (path is None):
+		FreeCAD.Console.PrintWarning("Object file '%s' not found!\n" %(item.fileName))
+		return None
+	layers = cache.get(path)
+	if (layers is None):
+		layers = importLWO.read(doc, path)
+		cache[path] = layers
+	prototype = layers.get(item.layer - 1)
+	if (isinstance(prototype, list)):
+		name = "%s_%d" %(os.path.splitext(os.path.basename(path))[0], item.layer)
+		part = doc.addObject('App::Part', getValidName(name))
+		part.Label = name
+		for me in prototype:
+			part.addObject(me)
+		part.Visibility = False
+		prototype = part
+		layers[item.layer - 1] = part
+	return prototype
+
+def read(doc, filename):
+	'''
+	Read the LWS file and create a link for each object item of the scene.
+	'''
+	FreeCAD.Console.PrintMessage("Importing LWS: %s\n" %(filename))
+	items = readScene(filename)
+	cache = {}
+	for item in items:
+		if (item.fileName is not None):
+			prototype = getPrototype(doc, cache, filename, item)
+			if (prototype is not None):
+				placement, scale = getWorld(items, item)
+				name = os.path.splitext(os.path.basename(item.fileName.replace('\\', '/')))[0]
+				link = doc.addObject('App::Link', getValidName(name))
+				link.Label = name
+				link.setLink(prototype)
+				link.Placement = placement
+				link.ScaleVector = scale
+	FreeCAD.Console.PrintMessage("Done Importing LWS File: %d items, %d object files\n" %(len(items), len(cache)))
+	return
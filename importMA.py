@@ -0,0 +1,252 @@
+# -*- coding: utf8 -*-
+
+__title__  = "FreeCAD Maya ASCII file importer"
+__author__ = "Jens M. Plonka"
+
+import re, FreeCAD, numpy, importMB
+from importMB    import Container, Chunk, Scene, addDagNode, computeMatrices, buildMesh, getReferenceName, UNSET_NORMAL
+from importUtils import getSpans
+
+BLOCK_SIZE = 0x100000 # bytes read at once
+
+NODE_TYPES = {b'transform': b'XFRM', b'mesh': b'DMSH'}
+
+XFRM_ATTRS = ('t', 'r', 's', 'ro')
+MESH_ATTRS = {'vt': 3, 'pt': 3, 'ed': 3, 'n': 3} # attribute => values per element
+
+# The polyFaces tags are replaced by numbers below FACE_CODE to convert
+# the whole list at once - the longer tags first as 'f' is part of 'fc'.
+FACE_CODE = -(1 << 40)
+FACE_TAGS = ((b'mu', 3), (b'mc', 4), (b'mf', 5), (b'fc', 6), (b'f', 1), (b'h', 2))
+
+LEADING     = re.compile(rb'\s*(?://[^\n]*(?:\n\s*|$))*')
+CREATE_NODE = re.compile(rb'createNode\s+(\S+)')
+NODE_NAME   = re.compile(rb'\s-n\s+"([^"]*)"')
+NODE_PARENT = re.compile(rb'\s-p\s+"([^"]*)"')
+ATTR_TYPE   = re.compile(rb'\s*-type\s+"([^"]*)"')
+ATTR_NAME   = re.compile(r'^\.?(.*?)(?:\[(\d+)(?::\d+)?\])?$')
+ANGLE_UNIT  = re.compile(rb'\s-a\s+(\w+)')
+UV_SET      = re.compile(r'^uvst\[(\d+)\]\.uvs([np])$')
+STRING      = re.compile(rb'\s*"([^"]*)"')
+NAMESPACE   = re.compile(rb'\s-ns\s+"([^"]*)"')
+REFERENCE   = re.compile(rb'file\s+(?:-\S+\s+(?:"[^"]*"|\S+)\s+)*?-r\s')
+LAST_STRING = re.compile(rb'"([^"]*)"\s*$')
+
+def countQuotes(data, start, end):
+	return data.count(b'"', start, end) - data.count(b'\\"', start, end)
+
+def readStatements(file, blockSize = BLOCK_SIZE):
+	'''
+	Yields the statements of the file - separated by ';' outside of strings.
+	Only the current block and the pending statement are kept in memory.
+	'''
+	parts  = [] # pieces of the pending statement
+	quotes = 0  # number of quotes in the pending statement
+	for block in iter(lambda: file.read(blockSize), b''):
+		pos = 0
+		while (True):
+			end = block.find(b';', pos)
+			if (end < 0):
+				parts.append(block[pos:])
+				quotes += countQuotes(block, pos, len(block))
+				break
+			quotes += countQuotes(block, pos, end)
+			if (quotes % 2):
+				parts.append(block[pos:end + 1]) # ';' is part of a string
+			else:
+				parts.append(block[pos:end])
+				yield b''.join(parts)
+				parts  = []
+				quotes = 0
+			pos = end + 1
+	if (parts):
+		yield b''.join(parts)
+
+def getNumbers(data, start, dtype):
+	# raises ValueError for non-numeric tokens
+	return numpy.array(data[start:].split(), dtype)
+
+def getFaces(data, edges):
+	'''
+	Decodes polyFaces data into the flat vertex indices, the polygon offsets
+	and the flat UV indices of each UV set (-1 for corners without UV).
+	Faces are given by their edges, negative ones (-1 - edge) are reversed.
+	Holes (h) are skipped.
+	'''
+	for tag, code in FACE_TAGS:
+		data = data.replace(tag, b' %d ' %(FACE_CODE - code))
+	values = getNumbers(data, 0, numpy.int64)
+	starts = numpy.flatnonzero(values <= FACE_CODE)
+	kinds  = FACE_CODE - values[starts]
+
+	faces = starts[kinds == 1]
+	positions, offsets = getSpans(faces + 2, values[faces + 1])
+	edge = values[positions]
+	indices = numpy.where(edge >= 0, edges[numpy.maximum(edge, 0), 0], edges[numpy.maximum(~edge, 0), 1])
+
+	# mu <uv set> <count> <uv indices> - for the previous face.
+	face_of = (numpy.cumsum(kinds == 1) - 1)[kinds == 3]
+	mu = starts[kinds == 3]
+	valid = face_of >= 0
+	face_of, mu = face_of[valid], mu[valid]
+	counts = numpy.minimum(values[mu + 2], numpy.diff(offsets)[face_of])
+	uv_indices = {}
+	for uv_set in numpy.unique(values[mu + 1]):
+		sel = values[mu + 1] == uv_set
+		uvs, o = getSpans(mu[sel] + 3, counts[sel])
+		corners, o = getSpans(offsets[face_of[sel]], counts[sel])
+		uv_indices[int(uv_set)] = numpy.full(len(indices), -1, numpy.int64)
+		uv_indices[int(uv_set)][corners] = values[uvs]
+	return indices, offsets, uv_indices
+
+class MeshMA():
+	def __init__(self):
+		self.arrays       = {} # attribute => list of (start, values)
+		self.faces        = [] # list of (start, polyFaces data)
+		self.uvNames      = {} # UV set index => name
+		self.intermediate = False
+
+	def get(self, name, dtype):
+		'''
+		Assembles the (n, width) array of the attribute from its pieces.
+		'''
+		pieces = self.arrays.get(name)
+		width  = MESH_ATTRS.get(name, 2)
+		if (pieces is None): return numpy.zeros((0, width), dtype)
+		count  = max([start + len(values) // width for start, values in pieces])
+		result = numpy.zeros((count, width), dtype)
+		for start, values in pieces:
+			n = len(values) // width
+			result[start:start + n] = values[:n * width].reshape((-1, width))
+		return result
+
+class ReaderMA():
+	def __init__(self, fileName, addMesh):
+		self.scene      = Scene(fileName, addMesh)
+		self.containers = {} # full DAG path => container
+		self.shortNames = {} # name => container, only used for relative parent paths
+		self.angleUnit  = numpy.pi / 180.0 # radians per angle unit
+		self.node       = None # transform or mesh the setAttr statements refer to
+		self.mesh       = None
+		self.referencing = set() # names of the transforms referenced files are placed under
+
+	def execute(self, statement):
+		start = LEADING.match(statement).end()
+		if (statement.startswith(b'setAttr', start)):
+			if (self.node is not None):
+				try:
+					self.setAttr(statement, start)
+				except ValueError as e:
+					FreeCAD.Console.PrintWarning("Skipped '%s': %s\n" %(statement[start:start + 80].decode('utf8', 'ignore'), e))
+		elif (statement.startswith(b'createNode', start)):
+			self.finishNode()
+			self.createNode(statement, start)
+		elif (statement.startswith(b'select', start)):
+			self.finishNode()
+		elif (statement.startswith(b'currentUnit', start)):
+			unit = ANGLE_UNIT.search(statement, start)
+			if (unit):
+				self.angleUnit = 1.0 if (unit.group(1).startswith(b'rad')) else numpy.pi / 180.0
+		elif (statement.startswith(b'file', start)):
+			self.addReference(statement, start)
+
+	def addReference(self, statement, start):
+		# file -r ... "path"; - the '-rdi' statements only describe nested references.
+		if (REFERENCE.match(statement, start)):
+			path = LAST_STRING.search(statement, start)
+			if (path):
+				namespace = NAMESPACE.search(statement, start)
+				namespace = namespace.group(1).decode('utf8') if (namespace) else None
+				self.scene.references.append((namespace, path.group(1).decode('utf8')))
+				self.referencing.add(getReferenceName(*self.scene.references[-1]))
+
+	def createNode(self, statement, start):
+		type = CREATE_NODE.match(statement, start).group(1)
+		id   = NODE_TYPES.get(type)
+		if (id is not None):
+			name   = NODE_NAME.search(statement, start)
+			parent = NODE_PARENT.search(statement, start)
+			name   = name.group(1).decode('utf8') if (name) else type.decode('utf8')
+			parent = parent.group(1).decode('utf8') if (parent) else None
+			self.node = Container(b'MA', id, 0, 0, 0)
+			addDagNode(self.containers, self.shortNames, self.node, name, parent)
+			self.mesh = MeshMA() if (id == b'DMSH') else None
+
+	def setAttr(self, statement, start):
+		q1 = statement.find(b'"', start)
+		q2 = statement.find(b'"', q1 + 1)
+		if (q1 < 0 or q2 < 0): return
+		name, first = ATTR_NAME.match(statement[q1 + 1:q2].decode('utf8', 'ignore')).groups()
+		pos  = q2 + 1
+		type = ATTR_TYPE.match(statement, pos)
+		if (type): pos = type.end()
+		first = int(first) if (first) else 0
+		if (self.mesh is None):
+			if (name in XFRM_ATTRS):
+				chunk = Chunk(b'MA', 0, 0, 0, None)
+				chunk.name = name
+				chunk.data = getNumbers(statement, pos, numpy.float64)
+				self.node.names[name] = chunk
+		elif (name in MESH_ATTRS):
+			dtype = numpy.int64 if (name == 'ed') else numpy.float32
+			self.mesh.arrays.setdefault(name, []).append((first, getNumbers(statement, pos, dtype)))
+		elif (UV_SET.match(name)):
+			index, kind = UV_SET.match(name).groups()
+			if (kind == 'p'):
+				self.mesh.arrays.setdefault(name, []).append((first, getNumbers(statement, pos, numpy.float32)))
+			else:
+				uvName = STRING.match(statement, pos)
+				if (uvName): self.mesh.uvNames[int(index)] = uvName.group(1).decode('utf8')
+		elif (name == 'fc'):
+			self.mesh.faces.append((first, statement[pos:]))
+		elif (name == 'io'):
+			self.mesh.intermediate = statement[pos:].strip() in (b'yes', b'on', b'true', b'1')
+
+	def finishNode(self):
+		node, mesh = self.node, self.mesh
+		self.node, self.mesh = None, None
+		if (node is not None):
+			computeMatrices([node], self.angleUnit)
+			if ((node.id == b'XFRM') and (node.name in self.referencing)):
+				self.scene.transforms[node.name] = node.matrix
+			if (mesh is not None) and (not mesh.intermediate):
+				try:
+					self.createObject(node, mesh)
+				except ValueError as e:
+					FreeCAD.Console.PrintWarning("Skipped mesh '%s': %s\n" %(node.name, e))
+
+	def createObject(self, node, mesh):
+		vt = mesh.get('vt', numpy.float32)
+		pt = mesh.get('pt', numpy.float32)
+		n  = min(len(vt), len(pt))
+		vt[:n] += pt[:n] # tweaks
+		edges = mesh.get('ed', numpy.int64)
+		if (len(edges) > 0) and (len(mesh.faces) > 0):
+			data = b' '.join([faces for first, faces in sorted(mesh.faces, key=lambda piece: piece[0])])
+			indices, offsets, uv_indices = getFaces(data, edges)
+			uvSets = {}
+			for uvSet, uvs in uv_indices.items():
+				uv = mesh.get('uvst[%d].uvsp' %(uvSet), numpy.float32)
+				uvSets[mesh.uvNames.get(uvSet, 'map%d' %(uvSet + 1))] = (uv, uvs)
+			# normals are given for each face vertex, unlocked normals aren't used.
+			normals = mesh.get('n', numpy.float32)
+			if (len(normals) != len(indices)) or (not (numpy.abs(normals) < UNSET_NORMAL).all()):
+				normals = None
+			self.scene.addMesh(buildMesh(node.name, node.matrix, vt, indices, offsets, uvSets, normals))
+		else:
+			FreeCAD.Console.PrintWarning("Mesh '%s' has no faces!\n" %(node.name))
+
+def readScene(fileName, addMesh):
+	'''
+	Read the ASCII Maya file statement by statement, each mesh is handed to
+	addMesh as soon as its node is complete.
+	'''
+	reader = ReaderMA(fileName, addMesh)
+	with open(fileName, 'rb') as file:
+		for statement in readStatements(file):
+			reader.execute(statement)
+		reader.finishNode()
+	return reader.scene
+
+def read(doc, fileName):
+	importMB.read(doc, fileName)
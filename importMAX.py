@@ -5,7 +5,7 @@ __author__ = "Jens M. Plonka"
 __url__    = "https://www.github.com/jmplonka/Importer3D"
 
 import FreeCAD, triangulate, numpy, zlib, sys, traceback
-from importUtils import missingDependency, canImport, newObject, getValidName, getByte, getShorts, getShort, getInts, getInt, getFloats, getFloat, setEndianess, LITTLE_ENDIAN
+from importUtils import missingDependency, canImport, ChunkProfiler, newObject, getValidName, getByte, getShorts, getShort, getInts, getInt, getFloats, getFloat, setEndianess, LITTLE_ENDIAN
 from math        import degrees
 from struct      import Struct, unpack
 from BasicShapes import Shapes, ViewProviderShapes
@@ -18,6 +18,8 @@ except:
 UNPACK_BOX_DATA = Struct('<hihhbff').unpack_from  # Index, int, short, short, byte, float, Length
 
 DEBUG         = False # Dump chunk content to console?
+PROFILE       = False # Collect chunk statistics and write them to <file>.profile.json?
+PROFILER      = None
 
 TYP_NAME     = 0x0962
 
@@ -220,7 +222,9 @@ class ChunkReader():
 		else:
 			chunk = primitiveReader(typ, chunkSize, level, number)
 		chunkData = data[offset + header:offset + chunkSize]
+		if (PROFILER): token = PROFILER.start()
 		chunk.setData(chunkData)
+		if (PROFILER): PROFILER.decoded(getChunkKey(chunk), header if (siz < 0) else chunkSize, token)
 		return offset + chunkSize, chunk
 
 class PointNi3s():
@@ -300,6 +304,10 @@ def getClsName(chunk):
 			return "'%r'" %(clsName)
 	return u"%04X" %(chunk.type)
 
+def getChunkKey(chunk):
+	if (isinstance(chunk, SceneChunk)): return getClsName(chunk)
+	return u"%04X" %(chunk.type)
+
 def getReferences(chunk):
 	references = []
 	refs = chunk.getFirst(0x2034)
@@ -566,7 +574,7 @@ def adjustMaterial(obj, mat):
 		else:
 			FreeCAD.Console.PrintWarning("Unknown material GUID=%016X (%s) - skipped\n!" %(uid, getClsName(mat)))
 
-		if (obj is not None) and (material is not None):
+		if (obj is not None) and (material is not None) and (obj.ViewObject):
 			obj.ViewObject.ShapeMaterial.AmbientColor  = material.get('ambient',  (0,0,0))
 			obj.ViewObject.ShapeMaterial.DiffuseColor  = material.get('diffuse',  (0.8,0.8,0.8))
 			#obj.ViewObject.ShapeMaterial.EmissiveColor = material.get('emissive', (0,0,0))
@@ -924,7 +932,8 @@ def createTube(doc, shape, tube, mat, mtx):
 	FreeCAD.Console.PrintMessage("    building Tube '%s' ... "%(name))
 	obj = createDocObject(doc, name, 'Part::FeaturePython')
 	Shapes.TubeFeature(obj)
-	vp = ViewProviderShapes.ViewProviderTube(obj.ViewObject)
+	if (obj.ViewObject):
+		ViewProviderShapes.ViewProviderTube(obj.ViewObject)
 	pBlock = getReferences(tube)[0]
 	try:
 		obj.InnerRadius = pBlock.children[2].getFirst(0x0100).data[0]
@@ -1101,7 +1110,9 @@ def createObject(doc, shape):
 		if (prnMtx): mtx = mtx.dot(prnMtx)
 		parent = getNodeParent(parent)
 
+	if (PROFILER): token = PROFILER.start()
 	created, uid = createMesh(doc, shape, msh, mtx, mat)
+	if (PROFILER): PROFILER.built(getClsName(msh), token)
 
 	if (not created):
 		if (uid is None):
@@ -1109,7 +1120,6 @@ def createObject(doc, shape):
 		else:
 			FreeCAD.Console.PrintWarning("skipped object %016X=%s!\n" %(uid, msh))
 	else:
-		doc.recompute()
 		FreeCAD.Console.PrintMessage("DONE!\n")
 
 def makeScene(doc, parent, level = 0):
@@ -1134,22 +1144,28 @@ def readScene(doc, ole, fileName):
 	makeScene(doc, SCENE_LIST[0], 0)
 
 def read(doc, fileName):
+	global PROFILER
 	if (olefile.isOleFile(fileName)):
-		setEndianess(LITTLE_ENDIAN)
-		ole = olefile.OleFileIO(fileName)
-		p = ole.getproperties('\x05DocumentSummaryInformation', convert_time=True, no_conversion=[10])
-		p = ole.getproperties('\x05SummaryInformation', convert_time=True, no_conversion=[10])
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== ClassData       ===\n")
-		readClassData(ole, fileName)
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== Config          ===\n")
-		readConfig(ole, fileName)
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== DllDirectory    ===\n")
-		readDllDirectory(ole, fileName)
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== ClassDirectory3 ===\n")
-		readClassDirectory3(ole, fileName)
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== VideoPostQueue  ===\n")
-		readVideoPostQueue(ole, fileName)
-		if (DEBUG): FreeCAD.Console.PrintMessage("==== Scene           ===\n")
-		readScene(doc, ole, fileName)
+		PROFILER = ChunkProfiler(fileName) if (PROFILE) else None
+		try:
+			setEndianess(LITTLE_ENDIAN)
+			ole = olefile.OleFileIO(fileName)
+			p = ole.getproperties('\x05DocumentSummaryInformation', convert_time=True, no_conversion=[10])
+			p = ole.getproperties('\x05SummaryInformation', convert_time=True, no_conversion=[10])
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== ClassData       ===\n")
+			readClassData(ole, fileName)
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== Config          ===\n")
+			readConfig(ole, fileName)
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== DllDirectory    ===\n")
+			readDllDirectory(ole, fileName)
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== ClassDirectory3 ===\n")
+			readClassDirectory3(ole, fileName)
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== VideoPostQueue  ===\n")
+			readVideoPostQueue(ole, fileName)
+			if (DEBUG): FreeCAD.Console.PrintMessage("==== Scene           ===\n")
+			readScene(doc, ole, fileName)
+		finally:
+			if (PROFILER): PROFILER.report() # the timings of failed imports as well
+			PROFILER = None
 	else:
 		FreeCAD.Console.PrintError("File seems to be no 3D Studio Max file!")
@@ -3,52 +3,63 @@
 __title__  = "FreeCAD Maya file importer"
 __author__ = "Jens M. Plonka"
 
-import sys, FreeCAD, numpy, uuid, triangulate
-from importUtils import newObject
-from struct      import unpack, Struct
+import os, sys, FreeCAD, numpy, uuid
+from collections import OrderedDict
+from importUtils import newIndexedObject, getValidName, findFile, setTexture, setVertexMap
+from triangulate import getTriangleCorners
+from iffReader   import ALIGNMENT, IffFile
+from struct      import Struct
 
 UID = Struct('<IHHHHHH').unpack_from
 
-ALIGNMENT = {
-	'FORM': 2, 'CAT ': 2, 'LIST': 2, 'PROP': 2, # => 16Bit
-	'FOR4': 4, 'CAT4': 4, 'LIS4': 4, 'PRO4': 4, # => 32Bit
-	'FOR8': 8, 'CAT8': 8, 'LIS8': 8, 'PRO8': 8, # => 64Bit
-}
+UNPACK = {fmt: Struct('>' + fmt).unpack_from for fmt in 'qfdiIhHB'}
+DTYPES = {'q': '>i8', 'f': '>f4', 'd': '>f8', 'i': '>i4', 'I': '>u4', 'h': '>i2', 'H': '>u2', 'B': 'u1'}
+
+PROGRESS_STEP = 0x10000 # bytes per progress step
+
+ROTATE_ORDER = ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx') # values of the 'ro' attribute
+
+BINARY_MAGIC = (b'FOR4', b'FOR8') # binary files are IFF files, ASCII files are MEL scripts
+
+UNSET_NORMAL = 1e19 # Maya writes 1e20 for normals that aren't locked
 
 DEBUG         = False # Dump chunk content to console?
 
+PARSE_CACHE_SIZE = 16 # referenced scenes kept parsed, the least recently used are dropped first
+PARSE_CACHE      = OrderedDict() # path key => ((modification time, size), meshes, scene)
+
 KNOWN_METHODS = {
-	'VERS': 'readString', # Version
-	'UVER': 'readString', #
-	'CREA': 'readCreate',
-	'MADE': 'readString',
-	'CHNG': 'readString',
-	'ICON': 'readString',
-	'INFO': 'readString',
-	'OBJN': 'readString',
-	'INCL': 'readString',
-	'PLUG': 'readPlugin', # required Plugin
-	'LUNI': 'readString', # Length Unit
-	'TUNI': 'readString', # Time Unit
-	'AUNI': 'readString', # Angle Unit
-	'FINF': 'readString', # File Information
-	'STR ': 'readStrAtr',
-	'SLCT': 'readString',
-	'DBLE': 'readDblAtr',
-	'CMP#': 'readComponent',
-	'FLGS': 'readFlgs',
-	'CMPD': 'readCmpd',
-	'CWFL': 'readConnect',
-	'DBL3': 'read3dAtr',
-	'FLT2': 'read2fAtr',
-	'FLT3': 'read3fAtr',
-	'ATTR': 'readAttrib',
-	'MESH': 'readMesh',
+	b'VERS': 'readString', # Version
+	b'UVER': 'readString', #
+	b'CREA': 'readCreate',
+	b'MADE': 'readString',
+	b'CHNG': 'readString',
+	b'ICON': 'readString',
+	b'INFO': 'readString',
+	b'OBJN': 'readString',
+	b'INCL': 'readString',
+	b'PLUG': 'readPlugin', # required Plugin
+	b'LUNI': 'readString', # Length Unit
+	b'TUNI': 'readString', # Time Unit
+	b'AUNI': 'readAngleUnit', # Angle Unit
+	b'FINF': 'readString', # File Information
+	b'STR ': 'readStrAtr',
+	b'SLCT': 'readString',
+	b'DBLE': 'readDblAtr',
+	b'CMP#': 'readComponent',
+	b'FLGS': 'readFlgs',
+	b'CMPD': 'readCmpd',
+	b'CWFL': 'readConnect',
+	b'DBL3': 'read3dAtr',
+	b'FLT2': 'read2fAtr',
+	b'FLT3': 'read3fAtr',
+	b'ATTR': 'readAttrib',
+	b'MESH': 'readMesh',
 	}
 
 TRANSLATE = {
-	b'\x00\x10\x2E\x55': 'MRIS', #mentalrayIblShape
-	b'\x00\x10\xA8\x5E': 'MMTX', #mia_material_x
+	b'\x00\x10\x2E\x55': b'MRIS', #mentalrayIblShape
+	b'\x00\x10\xA8\x5E': b'MMTX', #mia_material_x
 }
 
 class Container():
@@ -59,22 +70,26 @@ class Container():
 		self.size     = size
 		self.level    = level
 		self.children = []
+		self.names    = {} # attribute name => child
+		self.ids      = {} # chunk id => first child
 		self.branches = {}
 		self.matrix   = None
 		self.parent   = None
+		self.name     = None
+		self.path     = None # full DAG path
 
 	def __str__(self):
 		return "%s%s:%s" % ("  "*self.level, self.id, self.type)
 
+	def addChild(self, child):
+		self.children.append(child)
+		self.ids.setdefault(child.id, child)
+
 	def getProperty(self, name):
-		for child in self.children:
-			if (child.name == name): return child
-		return None
+		return self.names.get(name)
 
 	def getPropertyId(self, id):
-		for child in self.children:
-			if (child.id == id): return child
-		return None
+		return self.ids.get(id)
 
 	def getPosition(self):
 		pos = self.getProperty('t') # translation
@@ -86,8 +101,16 @@ class Container():
 			return mtx
 		return  None
 
-	def getRotation(self):
+	def getRotation(self, angleUnit):
 		rot = self.getProperty('r') # rotation
+		if (rot):
+			order = self.getProperty('ro') # rotation order
+			order = ROTATE_ORDER[int(numpy.ravel(order.data)[0]) % 6] if (order) else ROTATE_ORDER[0]
+			mtx = numpy.identity(4, numpy.float32)
+			for axis in order: # the first axis is applied first
+				mtx = numpy.dot(getAxisRotation(axis, rot.data['xyz'.index(axis)] * angleUnit), mtx)
+			return mtx
+		return None
 
 	def getScale(self):
 		scl = self.getProperty('s') # scale
@@ -99,19 +122,37 @@ class Container():
 			return mtx
 		return None
 
-	def getMatrix(self):
-		if (self.matrix is None):
-			pos = self.getPosition()
-			rot = self.getRotation()
-			scl = self.getScale()
-			self.matrix = numpy.identity(4, numpy.float32)
-			if (pos is not None): self.matrix = numpy.dot(self.matrix, pos)
-			if (rot is not None): self.matrix = numpy.dot(self.matrix, rot)
-			if (scl is not None): self.matrix = numpy.dot(self.matrix, scl)
-			if (self.parent is not None):
-				mtx = self.parent.getMatrix()
-				self.matrix = numpy.dot(self.matrix, mtx)
-		return self.matrix
+	def getLocalMatrix(self, angleUnit):
+		matrix = numpy.identity(4, numpy.float32)
+		pos = self.getPosition()
+		rot = self.getRotation(angleUnit)
+		scl = self.getScale()
+		if (pos is not None): matrix = numpy.dot(matrix, pos)
+		if (rot is not None): matrix = numpy.dot(matrix, rot)
+		if (scl is not None): matrix = numpy.dot(matrix, scl)
+		return matrix
+
+class MeshData():
+	def __init__(self, name, points, facets):
+		self.name    = name
+		self.points  = points # (n, 3) array in world coordinates
+		self.facets  = facets # (m, 3) array of point indices
+		self.uvs     = {}     # UV set name => ((k, 2) array of the texture coordinates, (m, 3) array of their indices)
+		self.normals = None   # ((k, 3) array of the normals, (m, 3) array of their indices)
+
+class Scene():
+	def __init__(self, fileName, addMesh):
+		self.fileName   = fileName
+		self.addMesh    = addMesh # called with each MeshData as soon as it is built
+		self.references = []      # (namespace, file name) of the referenced files
+		self.transforms = {}      # name => world matrix of the transforms referencing files
+
+	def getTransform(self, namespace, reference):
+		'''
+		The transform a reference is placed under is named after the
+		reference's namespace or, without namespace, after the referenced file.
+		'''
+		return self.transforms.get(getReferenceName(namespace, reference))
 
 class Chunk():
 	def __init__(self, id, pos, size, level, data):
@@ -129,25 +170,42 @@ class Chunk():
 		return "%s%s%s" % ("  "*self.level, n, d)
 
 class ReaderMB():
+	'''
+	Reads the chunks from a buffer (bytes or mmap) without copying: arrays are
+	numpy views on the buffer, strings are located with find.
+	'''
 	def __init__(self, data):
-		self.data       = data
+		self.buffer     = data
+		self.data       = memoryview(data)
 		self.pos        = 0
 		self.current    = None
-		self.containers = {}
+		self.containers = {} # full DAG path => container
+		self.shortNames = {} # name => container, only used for relative parent paths
+		self.angleUnit  = numpy.pi / 180.0 # radians per angle unit
 		self.alignment  = 4
 		self.progress   = None
 
+	def close(self):
+		'''
+		Breaks the DAG's parent links, so the chunks and their arrays are
+		released together with the reader.
+		'''
+		for container in self.containers.values():
+			container.parent = None
+			container.branches.clear()
+		self.containers.clear()
+		self.shortNames.clear()
+		self.current = None
+
 	def _get(self, fmt, size):
-		end = self.pos + size
-		value, = unpack('>' + fmt, self.data[self.pos:end])
-		self.pos = end
+		value, = UNPACK[fmt](self.data, self.pos)
+		self.pos += size
 		self.update()
 		return value
 
 	def _gets(self, fmt, size, count):
-		end = self.pos + (count * size)
-		values = unpack('>' + fmt*count, self.data[self.pos:end])
-		self.pos = end
+		values = numpy.frombuffer(self.data, DTYPES[fmt], count, self.pos)
+		self.pos += count * size
 		self.update()
 		return values
 
@@ -169,7 +227,7 @@ class ReaderMB():
 	def readBytes(self, count):   return self._gets('B', 1, count)
 
 	def readTypeID(self):
-		typeID = self.data[self.pos: self.pos + 4]
+		typeID = self.data[self.pos: self.pos + 4].tobytes()
 		self.pos += 4
 		typeID = TRANSLATE.get(typeID, typeID)
 		return typeID
@@ -182,28 +240,24 @@ class ReaderMB():
 		return self.readInt()
 
 	def readUID(self):
-		data = self.data[self.pos:self.pos+16]
-		a = UID(data)
+		a = UID(self.data, self.pos)
 		return "{%08X-%04X-%04X-%04X-%04X%04X%04X}" %(a[0], a[2], a[1], a[4], a[3], a[6], a[5])
 
 	def readString(self, chunk):
 		chunk.name = chunk.id
-		chunk.data = self.data[chunk.pos: chunk.pos+chunk.size].encode('utf8')
+		chunk.data = self.data[chunk.pos: chunk.pos+chunk.size].tobytes().rstrip(b'\0').decode('utf8', 'ignore')
 		self.pos = chunk.pos + chunk.size
 
 	def readCreate(self, chunk):
 		self.readConnect(chunk)
-		self.current.name = chunk.name
-		self.containers[chunk.name] = self.current
-		path = chunk.data[0]
-		if (path is not None):
-			names = path.split('|')
-			parent = self.containers.get(names[-1])
-			if (parent is not None):
-				parent.branches[chunk.data[0]] = self.current
-				self.current.parent = parent
-			else:
-				self.current.parent = None
+		addDagNode(self.containers, self.shortNames, self.current, chunk.name, chunk.data[0])
+
+	def readAngleUnit(self, chunk):
+		self.readString(chunk)
+		if (chunk.data.startswith('rad')):
+			self.angleUnit = 1.0
+		else:
+			self.angleUnit = numpy.pi / 180.0
 
 	def readConnect(self, chunk):
 		magic = self.readByte()
@@ -216,13 +270,10 @@ class ReaderMB():
 		chunk.data = (path, uid)
 
 	def readNullTerminated(self):
-		start = self.pos
-		while (self.data[self.pos] != '\0'):
-			self.pos += 1
-
-		end = self.pos if (self.pos < len(self.data)) else len(self.data)
-		string = self.data[start:end]
-		self.pos += 1
+		end = self.buffer.find(b'\0', self.pos)
+		if (end < 0): end = len(self.data)
+		string = self.data[self.pos:end].tobytes().decode('utf8', 'ignore')
+		self.pos = end + 1
 		self.update()
 		return string
 
@@ -255,18 +306,18 @@ class ReaderMB():
 	def readComponent(self, chunk):
 		self.readFlgs(chunk)
 		type = self.readTypeID()
-		if (type == 'CCCV'):
+		if (type == b'CCCV'):
 			data = (self.readInt(), self.readInt(), self.readInt())
-		elif (type == 'CLAT'):
+		elif (type == b'CLAT'):
 			data = self.readInts(7)
-		elif (type == 'CMDE'):
+		elif (type == b'CMDE'):
 			data = self.readInts(16)
 			self.pos += self.pos % 4 # align to 32 Bit
-		elif (type == 'CMDF'):
+		elif (type == b'CMDF'):
 			data = (self.readInt(), self.readInt(), self.readInt())
-		elif (type == 'CSCV'):
+		elif (type == b'CSCV'):
 			data = (self.readInt(), self.readInt(), self.readInt(), self.readInt(), self.readInt())
-		elif (type == 'CMDV'):
+		elif (type == b'CMDV'):
 			num = self.readInt()
 			a = []
 			for i in range(0, num):
@@ -298,7 +349,7 @@ class ReaderMB():
 		i    = self.readInt()
 		typ  = self.readTypeID()
 		value = None
-		if (typ == 'DBLE'):
+		if (typ == b'DBLE'):
 			value = self.readDouble()
 		chunk.data = (srt, ints1, sn, ln, i, value)
 
@@ -324,26 +375,22 @@ class ReaderMB():
 	def readFloat3Count(self):
 		cnt = self.readInt()
 		values = self.readFloats(cnt)
-		return numpy.reshape(values, (cnt/3, 3))
+		return values[:len(values) - len(values) % 3].reshape((-1, 3))
 
 	def readIntCount(self):
 		cnt = self.readInt()
 		return self.readInts(cnt)
 
-	def readShort4Count(self):
+	def readUIntCount(self):
 		cnt = self.readInt()
-		return self.readShorts(2 * cnt)
-
-	def readShort2Count(self):
-		cnt = self.readInt()
-		return self.readShorts(2 * cnt)
+		return self._gets('I', 4, cnt)
 
 	def readMesh(self, chunk):
 		chunk.name, mystery = self.readAttributeInfo()
 		vt   = self.readFloat3Count()# Vertex coordinates (x1, y1, z1, x2, y2, z2, ...)
-		ed   = self.readShort4Count()# Edges (f1, i1, f2, i2, i3) <=> f_i: 0x8000 -> new Edge
-		fc   = self.readShort2Count()# n x (Flg, EdgeIndex) Flag: 0x8000 -> reverse edge direction, 0x6000 -> end of N-Gon
-		lst4 = self.readFloatCount() #
+		ed   = self.readUIntCount()  # Edges (i1, i2) as pairs of vertex indices
+		fc   = self.readUIntCount()  # n x (Flg | EdgeIndex) Flag: 0x80000000 -> reverse edge direction, 0x60000000 -> end of N-Gon
+		lst4 = self.readFloatCount() # Normals (x1, y1, z1, x2, ...) of each face vertex if present
 		lst5 = self.readInts(3)
 		map  = self.readNullTerminated()
 		lst6 = self.readFloatCount() # Texture coordinates (x1, y1, x2, y2, ...)
@@ -354,50 +401,90 @@ class ReaderMB():
 	def readUnknown(self, chunk):
 		chunk.data = None
 
-	def readNext(self, level = 0):
-		next = None
-		if (self.pos < len(self.data)):
+	def readIndex(self):
+		'''
+		First pass: creates the containers and chunks with their type, id, offset
+		and size without decoding any payload.
+		'''
+		roots = []
+		stack = [(len(self.data), len(self.data), 4, None, -1)] # (end, next, alignment, container, level)
+		self.pos = 0
+		while (stack):
+			end, nxt, align, parent, level = stack[-1]
+			if (self.pos + 8 > end):
+				stack.pop()
+				self.pos = nxt
+				continue
 			type = self.readTypeID()
-			if (type in ALIGNMENT.keys()):
+			if (type in ALIGNMENT):
 				self.alignment = ALIGNMENT[type]
 				size = self.readSize()
 				id   = self.readTypeID()
-				next = Container(type, id, self.pos, size, level)
-				self.current = next
-				if (DEBUG): print(next)
-				self.analyseContainer(next)
+				next = Container(type, id, self.pos, size, level + 1)
+				nxt  = self.pos + size - 4
+				if (size % align):
+					nxt += align - (size % align)
+				stack.append((min(self.pos + size - 4, end), nxt, self.alignment, next, level + 1))
 			else:
+				self.alignment = align
 				size = self.readSize()
-				next = Chunk(type, self.pos, size, level, self.data[self.pos: self.pos+size])
-				method = ReaderMB.__dict__.get(KNOWN_METHODS.get(type), ReaderMB.readUnknown)
-				pos = self.pos
-				method(self, next)
-				if (self.pos < pos+size):
-					if (DEBUG): print("%s - Bytes not read: %s"%(type, ":".join(["%02X" %(ord(c)) for c in self.data[self.pos:pos+size]])))
-				self.pos = pos + size
-				if (size % self.alignment):
-					self.pos += self.alignment - (size % self.alignment) # add padding bytes due to alignment
-				if (DEBUG): print(next)
-		return next
-
-	def analyseContainer(self, container):
-		while (self.pos < (container.pos + container.size - 4)):
-			next = self.readNext(container.level + 1)
-			container.children.append(next)
-			if (next is None): break
-
-	def start(self, msg, cnt):
+				next = Chunk(type, self.pos, size, level + 1, None)
+				self.pos += size
+				if (size % align):
+					self.pos += align - (size % align) # add padding bytes due to alignment
+			if (parent is None):
+				roots.append(next)
+			else:
+				parent.addChild(next)
+		return roots
+
+	def getContainers(self, roots, ids):
+		'''
+		Returns the containers with one of the ids in file order.
+		'''
+		containers = []
+		stack = list(reversed(roots))
+		while (stack):
+			node = stack.pop()
+			if (isinstance(node, Container)):
+				if (node.id in ids): containers.append(node)
+				stack.extend(reversed(node.children))
+		return containers
+
+	def decodeChunk(self, chunk):
+		method = ReaderMB.__dict__.get(KNOWN_METHODS.get(chunk.id), ReaderMB.readUnknown)
+		self.pos = chunk.pos
+		method(self, chunk)
+		if (self.pos < chunk.pos + chunk.size):
+			if (DEBUG): print("%s - Bytes not read: %s"%(chunk.id, ":".join(["%02X" %(c) for c in self.data[self.pos:chunk.pos + chunk.size]])))
+		if (DEBUG): print(chunk)
+
+	def decodeContainer(self, container, ids = None):
+		'''
+		Second pass: decodes the container's chunks - only those with one of the
+		ids if given.
+		'''
+		self.current = container
+		if (DEBUG): print(container)
+		for child in container.children:
+			if (isinstance(child, Chunk) and ((ids is None) or (child.id in ids))):
+				self.decodeChunk(child)
+				if (child.name is not None):
+					container.names.setdefault(child.name, child)
+
+	def start(self, msg, cnt, step = 1):
 		self.progress = FreeCAD.Base.ProgressIndicator()
-		self.progress.start("%s ..." %(msg), cnt)
+		self.progress.start("%s ..." %(msg), cnt // step + 1)
+		self.progressStep  = step
 		self.procressValue = 0
 
 	def update(self):
 		if (self.progress):
-			i = self.pos - self.procressValue
-			self.procressValue = self.pos
-			while (i>0):
-				self.progress.next()
-				i -= 1
+			i = self.pos // self.progressStep - self.procressValue
+			if (i > 0):
+				self.procressValue += i
+				for n in range(i):
+					self.progress.next()
 
 	def stop(self):
 		if (self.progress is not None):
@@ -415,81 +502,279 @@ def getElementCount(name):
 				return int(bounds[1]) - int(bounds[0]) + 1
 	return 1
 
+def addDagNode(containers, shortNames, node, name, path):
+	'''
+	Registers the node under its full DAG path. The parent is given by its
+	full DAG path or, if unique, by its name.
+	'''
+	parent = None
+	if (path):
+		parent = containers.get(path if (path.startswith('|')) else '|' + path)
+		if (parent is None):
+			parent = shortNames.get(path.split('|')[-1])
+	node.name   = name
+	node.parent = parent
+	if (parent is not None):
+		parent.branches[name] = node
+		node.path = parent.path + '|' + name
+	else:
+		node.path = '|' + name
+	containers[node.path] = node
+	shortNames[name] = node
+
+def getAxisRotation(axis, angle):
+	mtx = numpy.identity(4, numpy.float32)
+	c, s = numpy.cos(angle), numpy.sin(angle)
+	i, j = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+	mtx[i, i] = c
+	mtx[i, j] = -s
+	mtx[j, i] = s
+	mtx[j, j] = c
+	return mtx
+
+def computeMatrices(containers, angleUnit):
+	'''
+	Computes the world matrices of the containers in one pass: sorted by the
+	depth of their DAG path every parent is done before its children.
+	'''
+	identity = numpy.identity(4, numpy.float32)
+	for container in sorted(containers, key=lambda c: (c.path or '').count('|')):
+		parent = container.parent.matrix if (container.parent is not None) else None
+		if (container.id == b'XFRM'):
+			local = container.getLocalMatrix(angleUnit)
+			container.matrix = local if (parent is None) else numpy.dot(parent, local)
+		else:
+			container.matrix = identity if (parent is None) else parent
+
 def getIndices(msh):
-	values = msh.data[2]
-	ed = numpy.reshape(values, (len(values)/4, 4))
-	values = msh.data[3]
-	fc = numpy.reshape(values, (len(values)/2, 2))
-	indices = []
-	i = 0
-	ngon = []
-	while (i < len(fc)):
-		flg = fc[i][0]
-		idx = fc[i][1]
-		f2 = fc[i][0]
-		e2 = fc[i][1]
-		e = ed[idx]
-		if (flg & 0x8000 != 0): # inverse line direction?
-			ngon.append(e[3])
+	'''
+	Decodes the faces of the mesh into the flat array of vertex indices and
+	the array of the polygon offsets (start of each polygon + end).
+	'''
+	ed = numpy.asarray(msh.data[2]).reshape((-1, 2)).astype(numpy.int64)
+	fc = numpy.asarray(msh.data[3]).astype(numpy.int64)
+	flags = fc & 0xE0000000
+	edges = ed[fc & 0x1FFFFFFF]
+	# 0x80000000 -> inverse edge direction
+	indices = numpy.where(flags & 0x80000000, edges[:, 1], edges[:, 0])
+	# 0x60000000 -> end of face, corners after the last face's end are dropped.
+	offsets = numpy.concatenate(([0], numpy.flatnonzero(flags & 0x60000000) + 1))
+	return indices[:offsets[-1]], offsets
+
+def getCornerUVs(uv, uv_indices):
+	'''
+	Returns the texture coordinates and their indices for the corners, corners
+	without UV refer to an additional (0, 0).
+	'''
+	uv = numpy.concatenate((numpy.asarray(uv, numpy.float32).reshape((-1, 2)), numpy.zeros((1, 2), numpy.float32)))
+	invalid = (uv_indices < 0) | (uv_indices >= len(uv) - 1)
+	return uv, numpy.where(invalid, len(uv) - 1, uv_indices)
+
+def transformNormals(mtx, normals):
+	# normals are transformed by the inverse transposed matrix
+	normals = numpy.dot(normals, numpy.linalg.pinv(mtx[:3, :3]))
+	length  = numpy.linalg.norm(normals, axis=-1)
+	return (normals / numpy.maximum(length, 1e-12)[..., None]).astype(numpy.float32)
+
+def buildMesh(name, mtx, vt, indices, offsets, uvSets = None, normals = None):
+	'''
+	Transforms the vertices by mtx and triangulates the polygons given as flat
+	vertex indices and offsets. The UV sets (name => (uv, uv index of each
+	polygon corner)) and the normals of each polygon corner are triangulated
+	the same way, they are kept indexed.
+	'''
+	cnt = len(vt)
+	# translate the points according to the transformation matrix
+	pt = numpy.ones((cnt, 4), numpy.float32)
+	pt[:,:3] = vt
+	tpt = numpy.transpose(numpy.dot(mtx, numpy.transpose(pt)))[:, 0:3]
+
+	# skip points, lines and faces with invalid indices!
+	mesh = MeshData(name, tpt, numpy.zeros((0, 3), numpy.int64))
+	if (cnt > 0):
+		corners, polygons = getTriangleCorners(tpt, numpy.minimum(indices, cnt - 1), offsets)
+		corners = corners[(indices[corners] < cnt).all(axis=1)]
+		mesh.facets = indices[corners]
+		if (uvSets):
+			for uvSet, (uv, uv_indices) in uvSets.items():
+				mesh.uvs[uvSet] = getCornerUVs(uv, uv_indices[corners])
+		if (normals is not None):
+			mesh.normals = (transformNormals(mtx, normals), corners)
+	return mesh
+
+def setMeshMaps(obj, mesh):
+	'''
+	Attaches the UV sets and normals to the mesh object. The first UV set
+	becomes the object's texture coordinates.
+	'''
+	for i, uvSet in enumerate(mesh.uvs):
+		uv, indices = mesh.uvs[uvSet]
+		if (i == 0):
+			setTexture(obj, uv, indices, None)
 		else:
-			ngon.append(e[1])
-		if (flg & 0x6000 != 0): # Reached end of face?
-			indices.append(ngon)
-			ngon = []
-		i += 1
-	return indices
-
-def createObject(doc, dmsh):
-	FreeCAD.Console.PrintMessage("Adding '%s' " %(dmsh.name))
-	xfrm = dmsh.parent
-	mtx = xfrm.getMatrix()
-	msh = dmsh.getPropertyId('MESH')
-	if (msh is not None):
-		vt = msh.data[1]
-		indices = getIndices(msh)
-		cnt = len(vt)
-		# translate the points according to the transformation matrix
-		pt = numpy.ones((cnt, 4), numpy.float32)
-		pt[:,:3] = vt
-		tpt = numpy.transpose(numpy.dot(mtx, numpy.transpose(pt)))
-
-		if (len(indices) > 0):
-			data = []
-			for pol in indices:
-				if (len(pol) > 2): # skip points and lines!
-					try:
-						ngon = [tpt[idx][0:3] for idx in pol]
-						for triangle in triangulate.getTriangles(ngon):
-							data.append(triangle)
-					except:
-						pass
-
-			if (len(data) > 0):
-				obj = newObject(doc, dmsh.name, data)
-			else:
-				FreeCAD.Console.PrintWarning("... no faces ... ")
-	else:
-		FreeCAD.Console.PrintWarning("... failed - Unknown mesh format at %X " %(dmsh.pos))
-	FreeCAD.Console.PrintMessage("Done!\n")
+			setVertexMap(obj, 'UV', uvSet, uv, indices)
+	if (mesh.normals is not None):
+		normals, indices = mesh.normals
+		setVertexMap(obj, 'Normal', 'Vertex', normals, indices)
 
-def read(doc, fileName):
+def getMesh(dmsh):
+	msh = dmsh.getPropertyId(b'MESH')
+	if (msh is not None):
+		indices, offsets = getIndices(msh)
+		map, vt, ed, fc, lst4, lst5, lst6, lst7, lst8 = msh.data
+		uvSets = None
+		if (len(lst6) > 1) and (len(lst7) >= len(indices)):
+			uv = numpy.asarray(lst6[:len(lst6) // 2 * 2], numpy.float32).reshape((-1, 2))
+			uvSets = {map or 'map1': (uv, numpy.asarray(lst7[:len(indices)], numpy.int64))}
+		normals = None
+		if (len(lst4) == 3 * len(indices)):
+			normals = numpy.asarray(lst4, numpy.float32).reshape((-1, 3))
+			if (not (numpy.abs(normals) < UNSET_NORMAL).all()): normals = None
+		return buildMesh(dmsh.name, dmsh.matrix, vt, indices, offsets, uvSets, normals)
+	FreeCAD.Console.PrintWarning("Mesh '%s' failed - Unknown mesh format at %X\n" %(dmsh.name, dmsh.pos))
+	return None
+
+def readScene(fileName, addMesh):
 	'''
 	Read the binary Maya file.
 	'''
+	scene = Scene(fileName, addMesh)
+	with IffFile(fileName) as file:
+		decodeScene(ReaderMB(file.map or b''), scene)
+	return scene
+
+def decodeScene(reader, scene):
+	'''
+	Decodes the meshes and the references of the file - the reader's arrays
+	are released on return, so the file's mapping can be closed.
+	'''
+	try:
+		reader.start("Reading file", len(reader.data), PROGRESS_STEP)
+		roots = reader.readIndex()
+		for container in reader.getContainers(roots, (b'HEAD',)):
+			reader.decodeContainer(container)
+			for chunk in container.children:
+				if (chunk.id == b'INCL'):
+					scene.references.append((None, chunk.data))
+		nodes = reader.getContainers(roots, (b'XFRM', b'DMSH'))
+		# Only the names and DAG paths are required to find the transformations of the meshes.
+		for container in nodes:
+			reader.decodeContainer(container, (b'CREA',))
+		referencing = set([getReferenceName(namespace, reference) for namespace, reference in scene.references])
+		required = set()
+		for container in nodes:
+			if ((container.id == b'DMSH') or (container.name in referencing)):
+				while ((container is not None) and (id(container) not in required)):
+					required.add(id(container))
+					container = container.parent
+		nodes = [container for container in nodes if (id(container) in required)]
+		for container in nodes:
+			reader.decodeContainer(container)
+		computeMatrices(nodes, reader.angleUnit)
+		for container in nodes:
+			if ((container.id == b'XFRM') and (container.name in referencing)):
+				scene.transforms[container.name] = container.matrix
+		reader.stop()
+
+		meshes = [container for container in nodes if (container.id == b'DMSH')]
+		reader.start("builing meshes", len(meshes))
+		for container in meshes:
+			reader.progress.next()
+			mesh = getMesh(container)
+			if (mesh is not None):
+				scene.addMesh(mesh)
+	finally:
+		reader.stop()
+		reader.close()
+
+def isBinary(fileName):
 	with open(fileName, 'rb') as file:
-		data = file.read()
-		reader = ReaderMB(data)
-		try:
-			reader.start("Reading file", len(data))
-			next = reader.readNext()
-			while (next is not None):
-				next = reader.readNext()
-			reader.stop()
-
-			reader.start("builing meshes", len(reader.containers))
-			for key, container in reader.containers.items():
-				reader.progress.next()
-				if (container.id == 'DMSH'):
-					createObject(doc, container)
-		finally:
-			reader.stop()
+		return file.read(4) in BINARY_MAGIC
+
+def loadScene(fileName, addMesh):
+	'''
+	Parses the binary or ASCII Maya file - told apart by their content, not
+	by the file extension - and hands each mesh to addMesh.
+	Returns the scene with the file's references.
+	'''
+	if (isBinary(fileName)):
+		return readScene(fileName, addMesh)
+	import importMA
+	return importMA.readScene(fileName, addMesh)
+
+def getReferenceName(namespace, reference):
+	return namespace or os.path.splitext(os.path.basename(reference.replace('\\', '/')))[0]
+
+def getReferencedScene(fileName):
+	'''
+	Parses the referenced file once per path and modification: the meshes
+	and the scene are kept in PARSE_CACHE, a changed modification time or
+	size of the file invalidates the entry.
+	'''
+	key = getPathKey(fileName)
+	stat = os.stat(fileName)
+	stamp = (stat.st_mtime_ns, stat.st_size)
+	entry = PARSE_CACHE.pop(key, None)
+	if ((entry is None) or (entry[0] != stamp)):
+		meshes = []
+		scene = loadScene(fileName, meshes.append)
+		entry = (stamp, meshes, scene)
+	PARSE_CACHE[key] = entry # most recently used
+	while (len(PARSE_CACHE) > PARSE_CACHE_SIZE):
+		PARSE_CACHE.popitem(last=False)
+	return entry[1], entry[2]
+
+def createObjects(doc, fileName, prototypes, referenced = False):
+	'''
+	Creates the meshes of the Maya file as soon as they are parsed. Each
+	referenced file becomes a hidden App::Part that is shared by all links
+	referencing it, prototypes maps the referenced files to their parts.
+	The links are placed by the transforms referencing the files.
+	'''
+	objects = []
+	def addMesh(mesh):
+		if (len(mesh.facets) > 0):
+			FreeCAD.Console.PrintMessage("Adding '%s'\n" %(mesh.name))
+			obj = newIndexedObject(doc, mesh.name, mesh.points, mesh.facets)
+			setMeshMaps(obj, mesh)
+			objects.append(obj)
+		else:
+			FreeCAD.Console.PrintWarning("Mesh '%s' has no faces!\n" %(mesh.name))
+	if (referenced):
+		meshes, scene = getReferencedScene(fileName)
+		for mesh in meshes:
+			addMesh(mesh)
+	else:
+		scene = loadScene(fileName, addMesh)
+	for namespace, reference in scene.references:
+		path = findFile(fileName, reference)
+		if (path is None):
+			FreeCAD.Console.PrintWarning("Referenced file '%s' not found!\n" %(reference))
+			continue
+		name = os.path.splitext(os.path.basename(path))[0]
+		key = getPathKey(path)
+		prototype = prototypes.get(key)
+		if (prototype is None):
+			prototypes[key] = False # cyclic references
+			prototype = doc.addObject('App::Part', getValidName(name))
+			prototype.Label = name
+			for obj in createObjects(doc, path, prototypes, True):
+				prototype.addObject(obj)
+			prototype.Visibility = False
+			prototypes[key] = prototype
+		if (prototype):
+			name = namespace or name
+			link = doc.addObject('App::Link', getValidName(name))
+			link.Label = name
+			link.setLink(prototype)
+			matrix = scene.getTransform(namespace, reference)
+			if (matrix is not None):
+				link.Placement = FreeCAD.Placement(FreeCAD.Matrix(*numpy.ravel(matrix).tolist()))
+			objects.append(link)
+	return objects
+
+def getPathKey(path):
+	return os.path.normcase(os.path.abspath(path))
+
+def read(doc, fileName):
+	createObjects(doc, fileName, {getPathKey(fileName): False})
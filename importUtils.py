@@ -4,14 +4,16 @@ __title__  = "Collection of utilities for 3D Mesh importers"
 __author__ = "Jens M. Plonka"
 __url__    = "https://www.github.com/jmplonka/Importer3D"
 
-import re, Mesh, FreeCAD
+import re, json, numpy, Mesh, FreeCAD
 
 from struct     import unpack
-from os.path    import join, dirname, basename
+from os.path    import join, dirname, basename, abspath, isabs, isfile, normpath, expandvars
 from sys        import executable
 from subprocess import call
+from time       import perf_counter
 
-INVALID_NAME = re.compile('^[0-9].*')
+INVALID_NAME     = re.compile('^[0-9].*')
+INVALID_PROPERTY = re.compile('[^0-9A-Za-z_]')
 
 _can_import  = True
 BIG_ENDIAN = '>'
@@ -23,6 +25,85 @@ DIR_X  = FreeCAD.Vector(1.0, 0.0, 0.0)
 DIR_Y  = FreeCAD.Vector(0.0, 1.0, 0.0)
 DIR_Z  = FreeCAD.Vector(0.0, 0.0, 1.0)
 
+class ChunkProfiler():
+	'''
+	Collects statistics per chunk type: count, bytes, time spent decoding and
+	time spent building (initialize/createShape). Times are exclusive - time
+	spent in nested chunks is booked on the nested chunk only.
+	'''
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.stats    = {}
+		self.stack    = []
+
+	def start(self):
+		self.stack.append(0.0)
+		return (len(self.stack), perf_counter())
+
+	def stop(self, token):
+		depth, start = token
+		elapsed = perf_counter() - start
+		nested  = self.stack[depth - 1]
+		del self.stack[depth - 1:] # also drops entries of nested calls that failed to stop
+		if (self.stack): self.stack[-1] += elapsed
+		return elapsed - nested
+
+	def getStat(self, key):
+		stat = self.stats.get(key)
+		if (stat is None):
+			stat = {'count': 0, 'bytes': 0, 'decode': 0.0, 'build': 0.0}
+			self.stats[key] = stat
+		return stat
+
+	def decoded(self, key, size, token):
+		stat = self.getStat(key)
+		stat['count']  += 1
+		stat['bytes']  += size
+		stat['decode'] += self.stop(token)
+
+	def built(self, key, token):
+		stat = self.getStat(key)
+		stat['build'] += self.stop(token)
+
+	def report(self):
+		rows = sorted(self.stats.items(), key=lambda row: row[1]['decode'] + row[1]['build'], reverse=True)
+		FreeCAD.Console.PrintMessage("%-40s %8s %12s %10s %10s\n" %('Chunk', 'Count', 'Bytes', 'Decode[s]', 'Build[s]'))
+		for key, stat in rows:
+			FreeCAD.Console.PrintMessage("%-40s %8d %12d %10.4f %10.4f\n" %(key, stat['count'], stat['bytes'], stat['decode'], stat['build']))
+		fileName = self.fileName + '.profile.json'
+		with open(fileName, 'w') as file:
+			json.dump({'file': self.fileName, 'chunks': [dict(stat, chunk=key) for key, stat in rows]}, file, indent=1)
+		FreeCAD.Console.PrintMessage("Chunk profile written to '%s'\n" %(fileName))
+
+class BulkCreation():
+	'''
+	Creates all objects of an import at once: recomputes are suspended and
+	the objects are created in one transaction. The document is recomputed
+	once at the end - or restored if the import fails.
+	'''
+	def __init__(self, doc, name):
+		self.doc  = doc
+		self.name = name
+
+	def __enter__(self):
+		self.frozen   = getattr(self.doc, 'RecomputesFrozen', None) # FreeCAD < 0.19 can't freeze recomputes
+		self.existing = set([obj.Name for obj in self.doc.Objects])
+		if (self.frozen is not None): self.doc.RecomputesFrozen = True
+		self.doc.openTransaction(self.name)
+		return self
+
+	def __exit__(self, type, value, tb):
+		if (type is None):
+			self.doc.commitTransaction()
+		else:
+			self.doc.abortTransaction()
+			# without undo the aborted transaction doesn't remove the new objects.
+			for name in [obj.Name for obj in self.doc.Objects if (obj.Name not in self.existing)]:
+				if (self.doc.getObject(name) is not None): self.doc.removeObject(name)
+		if (self.frozen is not None): self.doc.RecomputesFrozen = self.frozen
+		if (type is None): self.doc.recompute()
+		return False
+
 def setEndianess(endianess):
 	global ENDIANNESS
 	ENDIANNESS = endianess
@@ -46,12 +127,110 @@ def getValidName(name):
 	if (INVALID_NAME.match(name)): return "_%s"%(name.encode('utf8'))
 	return "%s"%(name.encode('utf8'))
 
+def getSpans(starts, counts):
+	'''
+	Returns the positions of all elements of the spans [starts[i], starts[i] + counts[i]).
+	'''
+	offsets = numpy.zeros(len(counts) + 1, numpy.int64)
+	numpy.cumsum(counts, out=offsets[1:])
+	return numpy.repeat(starts - offsets[:-1], counts) + numpy.arange(offsets[-1]), offsets
+
+def findFile(sceneName, fileName):
+	'''
+	Returns the path of a file referenced by a scene file or None. Relative
+	paths are searched in the scene's folder and its parent (the project or
+	content directory) - never in the current working directory. Files that
+	moved are looked up in the scene's folder.
+	'''
+	fileName = expandvars(fileName.replace('\\', '/'))
+	folder   = dirname(abspath(sceneName))
+	if (isabs(fileName)):
+		paths = (fileName, join(folder, basename(fileName)))
+	else:
+		paths = (join(folder, fileName), join(dirname(folder), fileName), join(folder, basename(fileName)))
+	for path in paths:
+		if (isfile(path)):
+			return normpath(path)
+	return None
+
 def newObject(doc, name, data):
 	obj = doc.addObject('Mesh::Feature', getValidName(name))
 	if (obj):
 		obj.Label = name
 		obj.Mesh = Mesh.Mesh(data)
-		obj.ViewObject.Lighting = "Two side"
+		if (obj.ViewObject):
+			obj.ViewObject.Lighting = "Two side"
+	return obj
+
+def newIndexedObject(doc, name, points, facets):
+	'''
+	Creates a mesh object from the (n, 3) array of points and the (m, 3)
+	array of facet vertex indices - shared points stay shared.
+	'''
+	return newObject(doc, name, (numpy.asarray(points, numpy.float64).reshape((-1, 3)).tolist(), numpy.asarray(facets, numpy.int64).reshape((-1, 3)).tolist()))
+
+def getMeshArrays(doc, objects = None):
+	'''
+	Returns (label, points, facets) of each mesh object of the document (or
+	of the given objects), the points in global coordinates.
+	'''
+	meshes = []
+	for obj in (doc.Objects if (objects is None) else objects):
+		if (obj.isDerivedFrom('Mesh::Feature')):
+			mesh = obj.Mesh.copy()
+			mesh.Placement = obj.getGlobalPlacement()
+			points, facets = mesh.Topology # the vectors are sequences of (x, y, z)
+			meshes.append((obj.Label, numpy.array(points, numpy.float32).reshape((-1, 3)), numpy.array(facets, numpy.int32).reshape((-1, 3))))
+	return meshes
+
+def saveMeshArrays(fileName, meshes):
+	'''
+	Writes the meshes (label, points, facets) as compressed numpy archive.
+	'''
+	arrays = {'names': numpy.array([name for name, points, facets in meshes], str)}
+	for i, (name, points, facets) in enumerate(meshes):
+		arrays['points_%d' %(i)] = points
+		arrays['facets_%d' %(i)] = facets
+	numpy.savez_compressed(fileName, **arrays)
+
+def getUsedValues(values, indices):
+	'''
+	Returns the rows of values referenced by indices and the indices into
+	them - objects using only a part of the values store only that part.
+	'''
+	used, indices = numpy.unique(indices, return_inverse=True)
+	return values[used], indices.reshape(-1)
+
+def setTexture(obj, uvs, indices, texture):
+	'''
+	Attaches the texture coordinates - the (n, 2) array of (u, v) and the
+	index into it for each facet corner - and the file name of the texture
+	image to the mesh object.
+	'''
+	if (obj is not None):
+		uvs, indices = getUsedValues(uvs, indices)
+		obj.addProperty('App::PropertyFloatList', 'TextureCoordinates', 'Texture', 'Texture coordinates (u, v)')
+		obj.TextureCoordinates = uvs.ravel().tolist()
+		obj.addProperty('App::PropertyIntegerList', 'TextureIndices', 'Texture', 'Index of the texture coordinates of each facet corner')
+		obj.TextureIndices = indices.tolist()
+		if (texture):
+			obj.addProperty('App::PropertyString', 'TextureImage', 'Texture', 'File name of the texture image')
+			obj.TextureImage = texture
+	return obj
+
+def setVertexMap(obj, group, name, values, indices):
+	'''
+	Attaches the values of a vertex map - the (n, dim) array of values and
+	the index into it for each facet corner - as properties "<group>_<name>"
+	and "<group>_<name>_Indices" to the mesh object.
+	'''
+	if (obj is not None):
+		values, indices = getUsedValues(values, indices)
+		prop = INVALID_PROPERTY.sub('_', "%s_%s" %(group, name))
+		obj.addProperty('App::PropertyFloatList', prop, group, "Values of the vertex map '%s'" %(name))
+		setattr(obj, prop, values.ravel().tolist())
+		obj.addProperty('App::PropertyIntegerList', prop + '_Indices', group, "Index of the values of the vertex map '%s' for each facet corner" %(name))
+		setattr(obj, prop + '_Indices', indices.tolist())
 	return obj
 
 def newGroup(parent, name):
@@ -4,7 +4,25 @@ __title__  = "Collection of 3D Mesh importers"
 __author__ = "Jens M. Plonka"
 __url__    = "https://www.github.com/jmplonka/Importer3D"
 
-import os, FreeCAD, import3DS, importLWO, importMAX, importMB, importGSM
+import os, io, traceback, importlib, FreeCAD, importCache
+from importUtils import BulkCreation
+
+# The reader modules are imported on first use only.
+READERS = {'.lwo': 'importLWO', '.lws': 'importLWS', '.3ds': 'import3DS', '.max': 'importMAX', '.ma': 'importMA', '.mb': 'importMB', '.gsm': 'importGSM'}
+
+SIGNATURES = ( # ((offset, magic bytes), ...) => reader, the weakest signature last
+	(((0, b'FORM'), (8, b'LWO2')),  'importLWO'),
+	(((0, b'FORM'), (8, b'LWOB')),  'importLWO'),
+	(((0, b'FORM'), (8, b'LWLO')),  'importLWO'),
+	(((0, b'LWSC'),),               'importLWS'),
+	(((0, b'//Maya ASCII'),),       'importMA'),
+	(((0, b'FOR4'),),               'importMB'),
+	(((0, b'FOR8'),),               'importMB'),
+	(((0, b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'),), 'importMAX'), # OLE compound file
+	(((0x28, b'MySg'),),            'importGSM'),
+	(((0, b'MM'),),                 'import3DS'), # main chunk 0x4D4D
+)
+HEADER_SIZE = 0x40
 
 def decode(name):
 	"decodes encoded strings"
@@ -18,36 +36,84 @@ def decode(name):
 			decodedName = name
 	return decodedName
 
+def sniff(filename):
+	'''
+	Returns the name of the reader module for the file's magic bytes or None.
+	'''
+	with io.open(filename, 'rb') as file: # open is the FreeCAD hook below
+		header = file.read(HEADER_SIZE)
+	for magic, reader in SIGNATURES:
+		if (all([header[offset:offset + len(tag)] == tag for offset, tag in magic])):
+			return reader
+	return None
+
+def getReader(filename):
+	'''
+	Returns the reader module for the file - by its content, else by its extension.
+	'''
+	try:
+		name = sniff(filename)
+	except OSError:
+		name = None
+	if (name is None):
+		name = READERS.get(os.path.splitext(filename)[1].lower())
+	if (name is None): return None
+	return importlib.import_module(name)
+
+def readCached(doc, filename, reader):
+	'''
+	Creates the meshes from the cache or reads the file and caches its meshes.
+	'''
+	try:
+		key = importCache.getKey(filename, reader)
+		if (importCache.load(doc, key)): return
+	except:
+		FreeCAD.Console.PrintWarning("Cache not available:\n%s" %(traceback.format_exc()))
+		key = None
+	existing = set([obj.Name for obj in doc.Objects])
+	reader.read(doc, filename)
+	objects = [obj for obj in doc.Objects if (obj.Name not in existing)]
+	if ((key is not None) and (len(objects) > 0)):
+		try:
+			importCache.store(key, objects, filename)
+		except:
+			FreeCAD.Console.PrintWarning("Can't cache '%s':\n%s" %(filename, traceback.format_exc()))
+
 def read(doc, filename):
-	name, ext = os.path.splitext(filename)
-	ext = ext.lower()
-	if (ext == '.lwo'):
-		importLWO.read(doc, filename)
-	elif (ext == '.3ds'):
-		import3DS.read(doc, filename)
-	elif (ext == '.max'):
-		importMAX.read(doc, filename)
-#	elif (ext == '.ma'):
-#		importMaya.read(doc, filename)
-	elif (ext == '.mb'):
-		importMB.read(doc, filename)
-	elif (ext == '.gsm'):
-		importGSM.read(doc, filename)
+	reader = getReader(filename)
+	if (reader is None):
+		FreeCAD.Console.PrintError("No suitable reader found for '%s'\n" %(filename))
 	else:
-		FreeCAD.Console.PrintError("No suitable reader found for ext=%s\n" %(ext))
+		with BulkCreation(doc, "Import %s" %(os.path.basename(filename))):
+			if (importCache.CACHE_ENABLED):
+				readCached(doc, filename, reader)
+			else:
+				reader.read(doc, filename)
 	return
 
+def readReported(doc, filename):
+	'''
+	Reads the file for the GUI: the readers' errors are reported on the
+	console instead of raised.
+	'''
+	try:
+		read(doc, filename)
+	except (KeyboardInterrupt, SystemExit):
+		raise
+	except BaseException: # import3DS gives up with a BaseException
+		FreeCAD.Console.PrintError("Can't import '%s':\n%s" %(filename, traceback.format_exc()))
+
 def insert(filename, docname):
 	'''
 	Called when freecad wants to import a file into an existing project.
 	'''
 	try:
 		doc = FreeCAD.getDocument(docname)
-		FreeCAD.ActiveDocument = doc
-		read(doc, filename)
-		return doc
-	except:
+	except NameError: # the document doesn't exist (any more)
 		return open(filename)
+	FreeCAD.ActiveDocument = doc
+	readReported(doc, filename)
+	return doc
 
 def open(filename):
 	'''
@@ -57,5 +123,5 @@ def open(filename):
 	doc = FreeCAD.newDocument(docname)
 	doc.Label = decode(docname)
 	FreeCAD.ActiveDocument = doc
-	read(doc, filename)
+	readReported(doc, filename)
 	return doc
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+
+__title__  = "Catmull-Clark subdivision of polygon meshes"
+__author__ = "Jens M. Plonka"
+__url__    = "https://www.github.com/jmplonka/Importer3D"
+
+import numpy as np
+
+def getEdgeKeys(a, b, count):
+	'''
+	Direction independent key of the edges a[i] - b[i] of a mesh with count points.
+	'''
+	a = np.asarray(a, np.int64)
+	b = np.asarray(b, np.int64)
+	return np.minimum(a, b) * count + np.maximum(a, b)
+
+def lookupWeights(keys, weightKeys, weights):
+	'''
+	Returns the weight for each edge key, 0.0 for edges without weight.
+	'''
+	result = np.zeros(len(keys), np.float64)
+	if (len(weightKeys) > 0):
+		order = np.argsort(weightKeys, kind='stable')
+		weightKeys = weightKeys[order]
+		pos = np.minimum(np.searchsorted(weightKeys, keys), len(weightKeys) - 1)
+		found = weightKeys[pos] == keys
+		result[found] = weights[order][pos[found]]
+	return result
+
+def sumAt(index, values, count):
+	'''
+	Sums the rows of values with the same index - like np.add.at but faster.
+	'''
+	if (values.ndim == 1):
+		return np.bincount(index, values, count)
+	return np.stack([np.bincount(index, values[:, k], count) for k in range(values.shape[1])], axis=1)
+
+def subdivideOnce(points, indices, offsets, weightKeys, weights):
+	'''
+	One Catmull-Clark step: every polygon with n corners becomes n quads.
+	Edges with a weight > 0 are blended towards the crease rule, boundary
+	and non-manifold edges are always creases.
+	'''
+	n       = len(points)
+	sizes   = np.diff(offsets)
+	faces   = len(sizes)
+	face_of = np.repeat(np.arange(faces), sizes)
+	nxt     = np.arange(1, len(indices) + 1)
+	nxt[offsets[1:] - 1] = offsets[:-1]
+	prv     = np.empty_like(nxt)
+	prv[nxt] = np.arange(len(indices))
+
+	# face points
+	face_pnts = sumAt(face_of, points[indices], faces) / sizes[:, None]
+
+	# edges: unique point pairs, corner c is the start of edge edge_of[c]
+	keys, first, edge_of, users = np.unique(getEdgeKeys(indices, indices[nxt], n), return_index=True, return_inverse=True, return_counts=True)
+	edge_of = edge_of.ravel()
+	ea = indices[first]
+	eb = indices[nxt[first]]
+	sharp = lookupWeights(keys, weightKeys, weights).clip(0.0, 1.0)
+	sharp[users != 2] = 1.0
+	mids = (points[ea] + points[eb]) * 0.5
+
+	# edge points
+	corner_pnts = face_pnts[face_of]
+	smooth = (points[ea] + points[eb] + sumAt(edge_of, corner_pnts, len(keys))) / (2.0 + users)[:, None]
+	edge_pnts = smooth + (mids - smooth) * sharp[:, None]
+
+	# vertex points: (Q + 2R + (k - 3)V) / k
+	ends    = np.concatenate((ea, eb))
+	valence = np.bincount(ends, minlength=n).astype(np.float64)
+	rings   = np.bincount(indices, minlength=n).astype(np.float64)
+	k       = np.maximum(valence, 1.0)[:, None]
+	q       = sumAt(indices, corner_pnts, n) / np.maximum(rings, 1.0)[:, None]
+	r       = (sumAt(ea, mids, n) + sumAt(eb, mids, n)) / k
+	vert_pnts = (q + 2.0 * r + (k - 3.0) * points) / k
+	# crease vertices: (6V + A + B) / 8 for 2 sharp edges, corners for more
+	creased = np.concatenate((sharp, sharp))
+	edges   = np.bincount(ends, creased > 0.0, n)
+	blend   = np.bincount(ends, creased, n) / np.maximum(edges, 1.0)
+	ws, we  = ea[sharp > 0.0], eb[sharp > 0.0]
+	crease  = (6.0 * points + sumAt(ws, points[we], n) + sumAt(we, points[ws], n)) / 8.0
+	crease[edges > 2] = points[edges > 2]
+	blend[edges < 2] = 0.0
+	vert_pnts += (crease - vert_pnts) * blend[:, None]
+	isolated = rings == 0
+	vert_pnts[isolated] = points[isolated]
+
+	# new mesh: [vertex points, edge points, face points]
+	e = len(keys)
+	quads = np.stack((indices, n + edge_of, n + e + face_of, n + edge_of[prv]), axis=1)
+	sub_pnts = np.concatenate((vert_pnts, edge_pnts, face_pnts))
+	# both halves of a weighted edge keep its weight
+	weighted = np.flatnonzero((sharp > 0.0) & (users == 2))
+	sub_keys = np.concatenate((getEdgeKeys(ea[weighted], n + weighted, len(sub_pnts)), getEdgeKeys(eb[weighted], n + weighted, len(sub_pnts))))
+	sub_weights = np.concatenate((sharp[weighted], sharp[weighted]))
+	return sub_pnts, quads.ravel(), np.arange(0, 4 * len(indices) + 1, 4, dtype=np.int64), face_of, sub_keys, sub_weights
+
+def catmullClark(points, indices, offsets, level, creases=None):
+	'''
+	Subdivides the polygon mesh level times using Catmull-Clark.
+
+	Args:
+		points:  (n, 3) array of the vertex coordinates.
+		indices: flat array of the vertex indices of all polygons.
+		offsets: array of the start offsets of the polygons in indices, the
+		         last element is the end offset of the last polygon.
+		level:   number of subdivision steps.
+		creases: optional (a, b, weights) arrays of edge weights (0..1) for
+		         the edges between the points a[i] and b[i].
+	Returns:
+		points:   (m, 3) array of the subdivided vertex coordinates.
+		indices:  flat array of the vertex indices of the quads.
+		offsets:  array of the start offsets of the quads.
+		polygons: (q,) array with the source polygon index of each quad.
+	'''
+	points  = np.asarray(points, np.float64)
+	indices = np.asarray(indices, np.int64)
+	offsets = np.asarray(offsets, np.int64)
+	# lines and points can't be subdivided.
+	valid = np.flatnonzero(np.diff(offsets) >= 3)
+	sizes = np.diff(offsets)[valid]
+	polygons = valid
+	indices  = indices[np.repeat(offsets[valid] - np.cumsum(np.concatenate(([0], sizes[:-1]))), sizes) + np.arange(sizes.sum())]
+	offsets  = np.concatenate(([0], np.cumsum(sizes)))
+	if (creases is None):
+		weightKeys, weights = np.zeros(0, np.int64), np.zeros(0, np.float64)
+	else:
+		a, b, weights = creases
+		weightKeys = getEdgeKeys(a, b, len(points))
+		weights    = np.asarray(weights, np.float64)
+	for i in range(level):
+		points, indices, offsets, parents, weightKeys, weights = subdivideOnce(points, indices, offsets, weightKeys, weights)
+		polygons = polygons[parents]
+	return points, indices, offsets, polygons
@@ -1,6 +1,7 @@
 from itertools import chain
 from math      import fabs
 import numpy   as np
+import FreeCAD
 
 # Ported from https://github.com/bjorkegeek/polytri
 
@@ -74,48 +75,220 @@ def anyPointInTriangle(triangle, points):
 	mtx = np.linalg.inv(np.vstack(stk).transpose())[:2]
 
 	for p in points:
+		# copies of the corners (bridge edges of holes) don't block the ear
+		if ((p == a).all() or (p == b).all() or (p == c).all()):
+			continue
 		ps, pt = np.dot(mtx, p - a)
 		if ps >= 0 and pt >= 0 and ps + pt <= 1:
 			return True
 	return False
 
-def getTriangles(ngon):
+def getTriangleIndices(ngon):
 	'''
-	Converts a polygon to a set of triangles that cover the same area.
-	  * Convex and non-convex polygons are supported.
-	  * Clockwise and counter-clockwise winding supported.
-	  * Polygon vertices must all be within a single plane
-	  * Inverted polygons are NOT supported
-	  * Polygons with holes (multi-wires) are NOT supported.
-
-	Args:
-	    ngon: A sequence of vertices making up the singe wire polygon, with each vertex
-		      described as a 3D point.
-			  The ngon is implicitly closed: a polygon with N sides should have N vertices.
-	Returns:
-		a generator of triangles, each specified in the same format as the input polygon
+	Same as getTriangles, but the triangles are given as triples of indices
+	into ngon instead of the vertices themselves.
 	'''
 	polygon = [np.array(x, np.float32) for x in ngon]
 
 	normal = calculateNormal(polygon)
+	index = list(range(len(polygon)))
 	i = 0
-	while len(polygon) > 2:
-		if i >= len(polygon):
+	while len(index) > 2:
+		if i >= len(index):
 			raise ValueError("Triangulation failed")
-		(a, b, c) = loppedSlice(polygon, i, 3)
+		(ia, ib, ic) = loppedSlice(index, i, 3)
+		a, b, c = polygon[ia], polygon[ib], polygon[ic]
 		if ((a == b).all() or (b == c).all()):
 			# Duplicate vertex, just skip
-			del polygon[(i + 1) % len(polygon)]
+			del index[(i + 1) % len(index)]
 		else:
 			x = np.cross(c - b, b - a)
 			dot = np.dot(normal, x)
 			yld = False
 			if dot > 1E-12:
 				triangle = (a, b, c)
-				if not anyPointInTriangle(triangle, loppedSliceInv(polygon, i, 3)):
-					del polygon[(i + 1) % len(polygon)]
-					yield triangle
+				if not anyPointInTriangle(triangle, [polygon[k] for k in loppedSliceInv(index, i, 3)]):
+					del index[(i + 1) % len(index)]
+					yield (ia, ib, ic)
 					i = 0
 					yld = True
 			if not yld:
 				i += 1
+
+def getTriangles(ngon):
+	'''
+	Converts a polygon to a set of triangles that cover the same area.
+	  * Convex and non-convex polygons are supported.
+	  * Clockwise and counter-clockwise winding supported.
+	  * Polygon vertices must all be within a single plane
+	  * Inverted polygons are NOT supported
+	  * Polygons with holes (multi-wires) are NOT supported.
+
+	Args:
+	    ngon: A sequence of vertices making up the singe wire polygon, with each vertex
+		      described as a 3D point.
+			  The ngon is implicitly closed: a polygon with N sides should have N vertices.
+	Returns:
+		a generator of triangles, each specified in the same format as the input polygon
+	'''
+	polygon = [np.array(x, np.float32) for x in ngon]
+	for a, b, c in getTriangleIndices(polygon):
+		yield (polygon[a], polygon[b], polygon[c])
+
+def getPlaneCoordinates(points, normal):
+	'''
+	Returns the 2D coordinates of the points in the plane with the normal. A
+	counter-clockwise contour - seen from the normal - stays counter-clockwise.
+	'''
+	normal = normal / np.linalg.norm(normal)
+	axis = np.zeros(3)
+	axis[np.argmin(np.abs(normal))] = 1.0
+	u = np.cross(axis, normal)
+	u /= np.linalg.norm(u)
+	v = np.cross(normal, u)
+	return np.stack((np.dot(points, u), np.dot(points, v)), axis=1)
+
+def sideOf(a, b, p):
+	'''
+	> 0 if p is left of the line a -> b, < 0 if it is right of it (2D, vectorised).
+	'''
+	return (b[..., 0] - a[..., 0]) * (p[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (p[..., 0] - a[..., 0])
+
+def findBridge(xy, ring, m):
+	'''
+	Returns the position in the counter-clockwise ring of the vertex that is
+	visible from the hole's rightmost vertex m, or None: a ray is cast from m
+	to +x, the closer end of the first edge hit is visible unless reflex
+	vertices lie in the triangle m, hit, end - the one with the smallest
+	angle to the ray is visible then.
+	'''
+	a, b, prv = xy[ring], xy[np.roll(ring, -1)], xy[np.roll(ring, 1)]
+	mx, my = m
+	crossing = (np.minimum(a[:, 1], b[:, 1]) <= my) & (np.maximum(a[:, 1], b[:, 1]) >= my) & (a[:, 1] != b[:, 1])
+	x = np.full(len(ring), np.inf)
+	x[crossing] = a[crossing, 0] + (my - a[crossing, 1]) * (b[crossing, 0] - a[crossing, 0]) / (b[crossing, 1] - a[crossing, 1])
+	x[x < mx] = np.inf
+	e = int(np.argmin(x))
+	if (np.isinf(x[e])): return None
+	hit = np.array((x[e], my))
+	if ((a[e] == hit).all()): return e
+	if ((b[e] == hit).all()): return (e + 1) % len(ring)
+	k = e if (a[e, 0] > b[e, 0]) else (e + 1) % len(ring)
+	p = xy[ring[k]]
+	# reflex vertices in the triangle m, hit, p block the view to p
+	sides = np.stack((sideOf(m, hit, a), sideOf(hit, p, a), sideOf(p, m, a)), axis=1)
+	inside = (sides >= 0).all(axis=1) | (sides <= 0).all(axis=1)
+	reflex = sideOf(prv, a, b) <= 0
+	blocking = np.flatnonzero(inside & reflex & ~(a == p).all(axis=1) & ~(a == m).all(axis=1))
+	if (len(blocking) > 0):
+		d = a[blocking] - m
+		angle = np.arctan2(np.abs(d[:, 1]), d[:, 0])
+		k = int(blocking[np.lexsort(((d ** 2).sum(axis=1), angle))[0]])
+	# a bridged vertex occurs more than once - choose the copy whose wedge contains m
+	for c in np.flatnonzero(ring == ring[k]):
+		if (sideOf(prv[c], a[c], b[c]) > 0):
+			visible = (sideOf(prv[c], a[c], m) > 0) and (sideOf(a[c], b[c], m) > 0)
+		else:
+			visible = (sideOf(prv[c], a[c], m) > 0) or (sideOf(a[c], b[c], m) > 0)
+		if (visible): return int(c)
+	return k
+
+def bridgeHoles(points, contours):
+	'''
+	Joins the holes into the outer contour so the polygon can be ear clipped:
+	the holes are taken from right to left, each one is connected by a bridge
+	edge from its rightmost vertex to a visible vertex of the contour and runs
+	in the opposite direction.
+
+	Args:
+		points:   (n, 3) array of the vertex coordinates.
+		contours: list of vertex index arrays, the first is the outer contour.
+	Returns:
+		the vertex indices of the joined contour.
+	'''
+	ring = np.asarray(contours[0], np.int64)
+	try:
+		normal = calculateNormal(points[ring])
+	except ValueError:
+		return ring
+	# calculateNormal points to the side the contour runs clockwise around.
+	xy = getPlaneCoordinates(np.asarray(points, np.float64), -normal)
+	holes = []
+	for hole in contours[1:]:
+		hole = np.asarray(hole, np.int64)
+		try:
+			if (np.dot(calculateNormal(points[hole]), normal) > 0):
+				hole = hole[::-1]
+		except ValueError:
+			continue # degenerated hole
+		holes.append(hole)
+	holes.sort(key=lambda hole: -xy[hole, 0].max())
+	for hole in holes:
+		h = int(np.argmax(xy[hole, 0]))
+		r = findBridge(xy, ring, xy[hole[h]])
+		if (r is None):
+			FreeCAD.Console.PrintWarning("Hole outside of its polygon - ignored!\n")
+			continue
+		ring = np.concatenate((ring[:r + 1], hole[h:], hole[:h + 1], ring[r:]))
+	return ring
+
+def getTriangleCorners(points, indices, offsets):
+	'''
+	Triangulates all polygons of a mesh at once.
+	  * Triangles and quads (convex or concave) are handled vectorised.
+	  * Polygons with more vertices are ear clipped one by one.
+	  * Points, lines and degenerated polygons are skipped.
+
+	Args:
+		points:  (n, 3) array of the vertex coordinates.
+		indices: flat array of the vertex indices of all polygons.
+		offsets: array of the start offsets of the polygons in indices, the
+		         last element is the end offset of the last polygon.
+	Returns:
+		corners:  (t, 3) array of positions into indices, so indices[corners]
+		          are the triangle's vertices and any per polygon corner data
+		          (UVs, normals) can be picked the same way.
+		polygons: (t,) array with the polygon index of each triangle.
+	'''
+	offsets  = np.asarray(offsets, np.int64)
+	counts   = np.diff(offsets)
+	starts   = offsets[:-1]
+	corners  = [np.zeros((0, 3), np.int64)]
+	polygons = [np.zeros(0, np.int64)]
+
+	tri = np.flatnonzero(counts == 3)
+	s = starts[tri]
+	corners.append(np.stack((s, s + 1, s + 2), axis=1))
+	polygons.append(tri)
+
+	quad = np.flatnonzero(counts == 4)
+	if (len(quad) > 0):
+		s = starts[quad]
+		a, b, c, d = [points[indices[s + k]] for k in range(4)]
+		n = np.cross(c - a, d - b)
+		# a reflex vertex at b or d requires the split along b-d
+		split = (np.einsum('ij,ij->i', np.cross(b - a, c - b), n) < 0) | (np.einsum('ij,ij->i', np.cross(d - c, a - d), n) < 0)
+		first  = np.where(split[:, None], np.stack((s, s + 1, s + 3), axis=1), np.stack((s, s + 1, s + 2), axis=1))
+		second = np.where(split[:, None], np.stack((s + 1, s + 2, s + 3), axis=1), np.stack((s, s + 2, s + 3), axis=1))
+		corners.append(first)
+		corners.append(second)
+		polygons.append(quad)
+		polygons.append(quad)
+
+	failed = []
+	for p in np.flatnonzero(counts > 4):
+		start = starts[p]
+		try:
+			ngon = points[indices[start:offsets[p + 1]]]
+			triangles = [(start + a, start + b, start + c) for a, b, c in getTriangleIndices(ngon)]
+		except ValueError:
+			triangles = [] # degenerated or self intersecting polygon
+		if (len(triangles) > 0):
+			corners.append(np.array(triangles, np.int64))
+			polygons.append(np.full(len(triangles), p, np.int64))
+		else:
+			failed.append(p)
+	if (len(failed) > 0):
+		FreeCAD.Console.PrintWarning("%d polygons can't be triangulated and are skipped: %s\n" %(len(failed), ', '.join([str(p) for p in failed[:10]]) + (', ...' if (len(failed) > 10) else '')))
+
+	return np.concatenate(corners), np.concatenate(polygons)